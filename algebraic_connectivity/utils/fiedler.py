@@ -0,0 +1,483 @@
+"""Fiedler values and vectors of the patient-disease graph and its communities"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.linalg import eigh
+from scipy.sparse.linalg import eigsh, lobpcg
+
+
+def laplacian_from_edges(rows, cols, n_nodes):
+    """Build the CSR Laplacian L = D - A of an undirected graph from edge index arrays.
+    Repeated edges add up, as in the adjacency built by the notebook."""
+    data = np.ones(2 * len(rows))
+    adjacency = sparse.coo_matrix(
+        (data, (np.concatenate([rows, cols]), np.concatenate([cols, rows]))),
+        shape=(n_nodes, n_nodes)
+    ).tocsr()
+    degrees = np.asarray(adjacency.sum(axis=1)).ravel()
+    return (sparse.diags(degrees) - adjacency).tocsr()
+
+
+def smallest_eigenpairs(laplacian, k=4, solver="auto", dense_max=500, v0=None):
+    """
+    Return the k smallest eigenvalues (ascending) and eigenvectors of a Laplacian.
+    solver: 'auto', 'dense', 'shift_invert', 'lobpcg' or 'eigsh'
+    'auto' uses dense eigh up to dense_max nodes, else shift-invert Lanczos,
+    falling back to LOBPCG if the factorization fails.
+    v0: optional starting vector (e.g. the previous Fiedler vector) for warm starts.
+    """
+    n_nodes = laplacian.shape[0]
+    k = min(k, n_nodes - 1)
+
+    if solver == "auto":
+        solver = "dense" if n_nodes <= dense_max else "shift_invert"
+
+    if solver == "dense":
+        values, vectors = eigh(laplacian.toarray(), subset_by_index=[0, k - 1])
+    elif solver == "shift_invert":
+        try:
+            # Eigenvalues closest to a small negative shift: L - sigma*I is positive definite
+            values, vectors = eigsh(laplacian, k=k, sigma=-1e-3, which="LM", v0=v0)
+        except (RuntimeError, MemoryError):
+            return smallest_eigenpairs(laplacian, k, "lobpcg", dense_max, v0)
+    elif solver == "lobpcg":
+        rng = np.random.default_rng(0)
+        x = rng.standard_normal((n_nodes, k))
+        if v0 is not None:
+            # Warm start: the constant vector and the previous Fiedler vector
+            x[:, 0] = 1.0
+            x[:, 1] = v0
+        # Jacobi preconditioner
+        diag = laplacian.diagonal()
+        precond = sparse.diags(1.0 / np.where(diag > 0, diag, 1.0))
+        values, vectors = lobpcg(laplacian, x, M=precond, largest=False, tol=1e-6, maxiter=500)
+    elif solver == "eigsh":
+        values, vectors = eigsh(laplacian, k=k, which="SM", v0=v0)
+    else:
+        raise ValueError("solver must be 'auto', 'dense', 'shift_invert', 'lobpcg' or 'eigsh'")
+
+    order = np.argsort(values)
+    return values[order], vectors[:, order]
+
+
+def _solve_community(task):
+    """Worker: (comm_id, rows, cols, n_nodes, k, solver, dense_max) -> (comm_id, n_nodes, λ₂, vector)."""
+    comm_id, rows, cols, n_nodes, k, solver, dense_max = task
+    if n_nodes < 4:
+        return comm_id, n_nodes, None, None
+    laplacian = laplacian_from_edges(rows, cols, n_nodes)
+    values, vectors = smallest_eigenpairs(laplacian, k, solver, dense_max)
+    return comm_id, n_nodes, float(values[1]), vectors[:, 1]
+
+
+class FiedlerComputer:
+    """
+    Compute Fiedler values and Fiedler vectors from Neo4j edge data,
+    with options for entire graph or per-community computations.
+
+    All community edges are pulled with a single query, partitioned by community
+    with NumPy, each Laplacian is built directly as CSR and the communities
+    are solved in a process pool.
+    """
+
+    query_get_communities = """
+    MATCH (n)
+    WHERE n.communityId IS NOT NULL
+    WITH n.communityId as communityId, count(n) as nodeCount
+    RETURN communityId, nodeCount
+    """
+
+    query_extract_edges = """
+    MATCH (n)-[r:HAS_DISEASE]-(m)
+    WHERE n.communityId = $comm_id AND n.patient_id IS NOT NULL
+    AND m.communityId = $comm_id AND m.entity_id IS NOT NULL
+    RETURN n.patient_id AS source, m.entity_id AS target
+    """
+
+    query_extract_all_edges = """
+    MATCH (n)-[r:HAS_DISEASE]-(m)
+    WHERE n.communityId IS NOT NULL AND n.patient_id IS NOT NULL
+    AND m.communityId IS NOT NULL AND m.entity_id IS NOT NULL
+    RETURN n.patient_id AS source, m.entity_id AS target
+    """
+
+    query_extract_community_edges = """
+    MATCH (n)-[r:HAS_DISEASE]-(m)
+    WHERE n.communityId IS NOT NULL AND n.patient_id IS NOT NULL
+    AND m.communityId = n.communityId AND m.entity_id IS NOT NULL
+    RETURN n.communityId AS communityId, n.patient_id AS source, m.entity_id AS target
+    """
+
+    def __init__(self, conn, dense_max=500, solver="auto"):
+        """
+        Initialize with the Neo4j connection class (with query and query_to_df).
+        dense_max: communities up to this size are solved with dense eigh
+        solver: see smallest_eigenpairs
+        """
+        self.conn = conn
+        self.dense_max = dense_max
+        self.solver = solver
+
+    def extract_edges(self, query, parameters=None):
+        """Extract edges from Neo4j as a DataFrame."""
+        if parameters:
+            return self.conn.query_to_df(query, parameters)
+        return self.conn.query_to_df(query)
+
+    def create_mappings(self, edges_data):
+        """Create node-to-index and reverse mappings."""
+        all_nodes = np.unique(np.concatenate([edges_data['source'].to_numpy(),
+                                              edges_data['target'].to_numpy()]))
+        node_to_idx = {node_id: idx for idx, node_id in enumerate(all_nodes)}
+        idx_to_node = dict(enumerate(all_nodes))
+        return node_to_idx, idx_to_node, len(all_nodes)
+
+    def build_matrices(self, edges_data, node_to_idx, n_nodes):
+        """Construct the Laplacian matrix (CSR)."""
+        if n_nodes < 4:
+            return None
+        rows = np.fromiter((node_to_idx[s] for s in edges_data['source']), dtype=np.int64)
+        cols = np.fromiter((node_to_idx[t] for t in edges_data['target']), dtype=np.int64)
+        return laplacian_from_edges(rows, cols, n_nodes)
+
+    def compute(self, mode="global", comm_id=None, k=4):
+        """
+        Compute Fiedler value and optionally the Fiedler vector.
+        mode: 'community' or 'global'
+        comm_id: required if mode='community'
+        k: number of eigenvalues to compute
+        """
+        if mode == "global":
+            query = self.query_extract_all_edges
+            parameters = None
+        elif mode == "community":
+            query = self.query_extract_edges
+            parameters = {'comm_id': comm_id}
+        else:
+            raise ValueError("mode must be either 'global' or 'community'")
+
+        edges_data = self.extract_edges(query, parameters)
+        if len(edges_data) == 0:
+            return None, None
+
+        # Index the nodes without Python dicts, sorted ids as in create_mappings
+        nodes, inverse = np.unique(
+            np.concatenate([edges_data['source'].to_numpy(), edges_data['target'].to_numpy()]),
+            return_inverse=True)
+        n_nodes = len(nodes)
+        if n_nodes < 4:
+            return None, None
+
+        n_edges = len(edges_data)
+        laplacian = laplacian_from_edges(inverse[:n_edges], inverse[n_edges:], n_nodes)
+        values, vectors = smallest_eigenpairs(laplacian, k, self.solver, self.dense_max)
+        return values[1], vectors[:, 1]
+
+    def partition_edges(self, records):
+        """
+        Partition community edges with NumPy group-by.
+        records: list of {communityId, source, target} dictionaries
+        Returns a list of (comm_id, rows, cols, nodes) with local node indices,
+        nodes holds the sorted node ids of the community.
+        """
+        if not records:
+            return []
+        comms = np.fromiter((r['communityId'] for r in records), dtype=np.int64, count=len(records))
+        node_ids = np.array([r['source'] for r in records] + [r['target'] for r in records], dtype=object)
+        nodes_all, inverse = np.unique(node_ids.astype(str), return_inverse=True)
+        n_edges = len(records)
+        src, tgt = inverse[:n_edges], inverse[n_edges:]
+
+        # Group the edges by community
+        order = np.argsort(comms, kind="stable")
+        comms_sorted = comms[order]
+        comm_ids, starts = np.unique(comms_sorted, return_index=True)
+        bounds = np.append(starts, n_edges)
+
+        partitions = []
+        for comm_id, start, end in zip(comm_ids, bounds[:-1], bounds[1:]):
+            idx = order[start:end]
+            local_nodes, local = np.unique(np.concatenate([src[idx], tgt[idx]]), return_inverse=True)
+            m = len(idx)
+            partitions.append((int(comm_id), local[:m], local[m:], nodes_all[local_nodes]))
+        return partitions
+
+    def solve_partitions(self, partitions, k=4, n_workers=None):
+        """
+        Solve the partitions returned by partition_edges.
+        Returns a list of (comm_id, n_nodes, λ₂, Fiedler vector), λ₂ is None below 4 nodes.
+        """
+        tasks = [(comm_id, rows, cols, len(nodes), k, self.solver, self.dense_max)
+                 for comm_id, rows, cols, nodes in partitions]
+
+        n_workers = n_workers or os.cpu_count() or 1
+        if n_workers > 1 and len(tasks) > 1:
+            # Largest communities first so that they do not end up last
+            tasks.sort(key=lambda t: -t[3])
+            chunksize = max(1, len(tasks) // (4 * n_workers))
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                return list(executor.map(_solve_community, tasks, chunksize=chunksize))
+        return [_solve_community(task) for task in tasks]
+
+    def compute_all_communities(self, k=4, n_workers=None, return_vectors=False):
+        """
+        Compute λ₂ for each Leiden community.
+        n_workers: processes for the eigen-solves, default os.cpu_count(), 1 runs serially
+        return_vectors: also return {communityId: (node ids, Fiedler vector)}
+        """
+        records = self.conn.query(self.query_extract_community_edges)
+        partitions = self.partition_edges(records)
+        nodes_by_comm = {comm_id: nodes for comm_id, _, _, nodes in partitions}
+        solved = self.solve_partitions(partitions, k, n_workers)
+
+        results = []
+        vectors = {}
+        for comm_id, n_nodes, lambda_2, vector in sorted(solved, key=lambda s: s[0]):
+            if lambda_2 is None:
+                print(f"Skipping community {comm_id} (n={n_nodes}) — no valid λ₂")
+                continue
+            results.append({
+                "communityId": comm_id,
+                "lambda_2": round(lambda_2, 2)
+            })
+            if return_vectors:
+                vectors[comm_id] = (nodes_by_comm[comm_id], vector)
+
+        df = pd.DataFrame(results, columns=["communityId", "lambda_2"])
+        if return_vectors:
+            return df, vectors
+        return df
+
+    def label_bipartition(self, fiedler_vector, idx_to_node):
+        """Label nodes in Neo4j as FiedlerPositive or FiedlerNegative, one batch per sign."""
+        n_nodes = len(fiedler_vector)
+        for label_name, mask in [("FiedlerPositive", fiedler_vector >= 0),
+                                 ("FiedlerNegative", fiedler_vector < 0)]:
+            rows = [{'node_id': str(idx_to_node[idx]), 'fiedler_val': round(float(fiedler_vector[idx]), 4)}
+                    for idx in np.flatnonzero(mask)]
+            if not rows:
+                continue
+            update_query = f"""
+            UNWIND $rows AS row
+            CALL (row) {{
+                MATCH (p:Patient)
+                WHERE toString(p.patient_id) = row.node_id
+                SET p.fiedlerValue = row.fiedler_val
+                SET p:{label_name}
+                RETURN count(p) AS updated_patients
+                  }}
+            CALL (row) {{
+                MATCH (d:Disease)
+                WHERE toString(d.entity_id) = row.node_id
+                SET d.fiedlerValue = row.fiedler_val
+                SET d:{label_name}
+                RETURN count(d) AS updated_diseases
+                }}
+            RETURN count(*) AS updated
+            """
+            self.conn.query(update_query, parameters={'rows': rows})
+
+        print(f"\nAdded Fiedler labels to {n_nodes} nodes in Neo4j")
+        print(f"Positive nodes: {sum(fiedler_vector >= 0)}")
+        print(f"Negative nodes: {sum(fiedler_vector < 0)}")
+
+
+class CommunityState:
+    """Laplacian, node ids and last Fiedler pair of one community."""
+
+    def __init__(self, nodes, laplacian, lambda_2=None, vector=None):
+        self.nodes = list(nodes)
+        self.index = {node_id: idx for idx, node_id in enumerate(self.nodes)}
+        self.laplacian = laplacian
+        self.lambda_2 = lambda_2
+        self.vector = vector
+
+
+class IncrementalFiedler:
+    """
+    Keeps the Laplacian and the last Fiedler vector of every community, so that
+    batches of HAS_DISEASE edge inserts and deletes only recompute the communities
+    they touch. The eigensolver of a touched community is warm-started from its
+    previous Fiedler vector (LOBPCG above dense_max nodes, dense eigh below).
+
+    Edges are {communityId, source, target} records (or a DataFrame with these
+    columns), the same rows as FiedlerComputer.query_extract_community_edges.
+    """
+
+    def __init__(self, conn=None, k=4, dense_max=500, tol=1e-3):
+        """
+        conn: Neo4j connection class, only needed by initialize without records
+        tol: λ₂ changes above tol are reported as changed
+        """
+        self.computer = FiedlerComputer(conn, dense_max=dense_max, solver="auto")
+        self.k = k
+        self.dense_max = dense_max
+        self.tol = tol
+        self.communities = {}
+
+    @staticmethod
+    def _edge_records(edges):
+        """(communityId, source, target) tuples from records or a DataFrame."""
+        if edges is None:
+            return []
+        if isinstance(edges, pd.DataFrame):
+            edges = edges.to_dict("records")
+        return [(int(e['communityId']), str(e['source']), str(e['target'])) for e in edges]
+
+    def initialize(self, records=None, n_workers=None):
+        """
+        Full computation, as FiedlerComputer.compute_all_communities, keeping the state.
+        records: community edges, pulled from Neo4j if None
+        """
+        if records is None:
+            records = self.computer.conn.query(self.computer.query_extract_community_edges)
+        elif isinstance(records, pd.DataFrame):
+            records = records.to_dict("records")
+        partitions = self.computer.partition_edges(records)
+        solved = {s[0]: s for s in self.computer.solve_partitions(partitions, self.k, n_workers)}
+
+        self.communities = {}
+        for comm_id, rows, cols, nodes in partitions:
+            _, _, lambda_2, vector = solved[comm_id]
+            self.communities[comm_id] = CommunityState(
+                nodes, laplacian_from_edges(rows, cols, len(nodes)), lambda_2, vector)
+        return self.results()
+
+    def _update_laplacian(self, state, added, removed):
+        """
+        Apply edge inserts and deletes to a community Laplacian in place.
+        New nodes are appended, nodes left without edges are dropped.
+        Returns the warm-start vector aligned with the new node order
+        and the number of deletes of unknown edges.
+        """
+        for pair in added:
+            for node_id in pair:
+                if node_id not in state.index:
+                    state.index[node_id] = len(state.nodes)
+                    state.nodes.append(node_id)
+        n_nodes = len(state.nodes)
+        laplacian = state.laplacian.copy()
+        laplacian.resize((n_nodes, n_nodes))
+
+        # Only delete edges that exist, counting repeated deletes within the batch
+        pending = {}
+        rm_rows, rm_cols, skipped = [], [], 0
+        for source, target in removed:
+            i, j = state.index.get(source), state.index.get(target)
+            if i is None or j is None:
+                skipped += 1
+                continue
+            key = (min(i, j), max(i, j))
+            available = -laplacian[i, j] - pending.get(key, 0)
+            if available <= 0:
+                skipped += 1
+                continue
+            pending[key] = pending.get(key, 0) + 1
+            rm_rows.append(i)
+            rm_cols.append(j)
+
+        add_rows = np.array([state.index[s] for s, _ in added], dtype=np.int64)
+        add_cols = np.array([state.index[t] for _, t in added], dtype=np.int64)
+        laplacian = (laplacian
+                     + laplacian_from_edges(add_rows, add_cols, n_nodes)
+                     - laplacian_from_edges(np.array(rm_rows, dtype=np.int64),
+                                            np.array(rm_cols, dtype=np.int64), n_nodes)).tocsr()
+        laplacian.eliminate_zeros()
+
+        # Previous vector for the old nodes, zero for the new ones
+        v0 = np.zeros(n_nodes)
+        if state.vector is not None:
+            v0[:len(state.vector)] = state.vector
+
+        keep = laplacian.diagonal() > 0
+        if not keep.all():
+            kept = np.flatnonzero(keep)
+            laplacian = laplacian[kept][:, kept]
+            state.nodes = [state.nodes[idx] for idx in kept]
+            state.index = {node_id: idx for idx, node_id in enumerate(state.nodes)}
+            v0 = v0[kept]
+
+        state.laplacian = laplacian
+        return v0, skipped
+
+    def _solve(self, state, v0):
+        """Warm-started solve of one community, None below 4 nodes."""
+        n_nodes = len(state.nodes)
+        if n_nodes < 4:
+            return None, None
+        use_warm = n_nodes > self.dense_max and np.any(v0)
+        solver = "lobpcg" if use_warm else "dense"
+        values, vectors = smallest_eigenpairs(state.laplacian, self.k, solver,
+                                              self.dense_max, v0 if use_warm else None)
+        vector = vectors[:, 1]
+        # Keep the sign of the previous vector
+        if np.dot(vector, v0) < 0:
+            vector = -vector
+        return float(values[1]), vector
+
+    def apply_batch(self, inserts=None, deletes=None):
+        """
+        Apply a batch of edge inserts and deletes and recompute the touched communities.
+        Returns a DataFrame with one row per touched community:
+        communityId, n_nodes, lambda_2_prev, lambda_2, delta, changed (|delta| > tol).
+        """
+        added, removed = {}, {}
+        for comm_id, source, target in self._edge_records(inserts):
+            added.setdefault(comm_id, []).append((source, target))
+        for comm_id, source, target in self._edge_records(deletes):
+            removed.setdefault(comm_id, []).append((source, target))
+
+        report = []
+        skipped = 0
+        for comm_id in sorted(set(added) | set(removed)):
+            state = self.communities.get(comm_id)
+            if state is None:
+                if comm_id not in added:
+                    skipped += len(removed[comm_id])
+                    continue
+                state = CommunityState([], sparse.csr_matrix((0, 0)))
+                self.communities[comm_id] = state
+
+            lambda_prev = state.lambda_2
+            v0, n_skipped = self._update_laplacian(state, added.get(comm_id, []),
+                                                   removed.get(comm_id, []))
+            skipped += n_skipped
+            state.lambda_2, state.vector = self._solve(state, v0)
+            if not state.nodes:
+                del self.communities[comm_id]
+
+            if lambda_prev is None or state.lambda_2 is None:
+                delta = None
+                changed = lambda_prev != state.lambda_2
+            else:
+                delta = state.lambda_2 - lambda_prev
+                changed = abs(delta) > self.tol
+            report.append({
+                "communityId": comm_id,
+                "n_nodes": len(state.nodes),
+                "lambda_2_prev": lambda_prev,
+                "lambda_2": state.lambda_2,
+                "delta": delta,
+                "changed": changed
+            })
+
+        if skipped:
+            print(f"Ignored {skipped} deletes of unknown edges")
+        return pd.DataFrame(report, columns=["communityId", "n_nodes", "lambda_2_prev",
+                                             "lambda_2", "delta", "changed"])
+
+    def fiedler_vector(self, comm_id):
+        """Node ids and current Fiedler vector of a community."""
+        state = self.communities[comm_id]
+        return state.nodes, state.vector
+
+    def results(self):
+        """Current λ₂ per community, as returned by compute_all_communities."""
+        results = [{"communityId": comm_id, "lambda_2": round(state.lambda_2, 2)}
+                   for comm_id, state in sorted(self.communities.items())
+                   if state.lambda_2 is not None]
+        return pd.DataFrame(results, columns=["communityId", "lambda_2"])
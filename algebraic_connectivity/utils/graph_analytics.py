@@ -0,0 +1,288 @@
+"""In-process analytics of the patient-disease graph, without GDS"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from utils.fiedler import FiedlerComputer
+
+
+def _relabel_by_size(labels, valid=None):
+    """Relabel 0..k-1 by decreasing size (ties by first occurrence), -1 outside valid."""
+    valid = np.ones(len(labels), dtype=bool) if valid is None else valid
+    out = np.full(len(labels), -1, dtype=np.int64)
+    if not valid.any():
+        return out
+    uniques, first, inverse, counts = np.unique(labels[valid], return_index=True,
+                                                return_inverse=True, return_counts=True)
+    order = np.lexsort((first, -counts))
+    rank = np.empty(len(uniques), dtype=np.int64)
+    rank[order] = np.arange(len(uniques))
+    out[valid] = rank[inverse]
+    return out
+
+
+class GraphAnalytics:
+    """
+    Local replacement of the GDS steps of KG_Analysis.ipynb. The HAS_DISEASE edge list
+    is pulled once (or read from case_has_disease.csv) into a CSR adjacency matrix;
+    components, degree distributions, communities, conductance and λ₂ per community
+    are computed with NumPy/SciPy, and componentId/communityId are written back
+    in one batch per label.
+
+    Nodes are indexed patients first, then diseases.
+    """
+
+    query_edges = """
+    MATCH (p:Patient)-[:HAS_DISEASE]->(d:Disease)
+    RETURN p.patient_id AS source, d.entity_id AS target, d.text AS disease,
+           p.communityId AS sourceCommunity, d.communityId AS targetCommunity
+    """
+
+    query_write_patients = """
+    UNWIND $rows AS row
+    MATCH (p:Patient {patient_id: row.id})
+    SET p.componentId = row.componentId, p.communityId = row.communityId
+    """
+
+    query_write_diseases = """
+    UNWIND $rows AS row
+    MATCH (d:Disease {entity_id: row.id})
+    SET d.componentId = row.componentId, d.communityId = row.communityId
+    """
+
+    def __init__(self, edges, conn=None):
+        """
+        edges: DataFrame with source (patient_id) and target (entity_id) columns,
+        optionally disease (text) and sourceCommunity/targetCommunity.
+        Use from_neo4j or from_csv to build it.
+        """
+        self.conn = conn
+        edges = edges.drop_duplicates(subset=["source", "target"])
+
+        patients, src = np.unique(edges["source"].astype(str).to_numpy(), return_inverse=True)
+        diseases, tgt = np.unique(edges["target"].astype(str).to_numpy(), return_inverse=True)
+        self.n_patients = len(patients)
+        self.node_ids = np.concatenate([patients, diseases])
+        self.is_patient = np.arange(len(self.node_ids)) < self.n_patients
+        self.src = src
+        self.tgt = tgt + self.n_patients
+
+        n_nodes = len(self.node_ids)
+        self.adjacency = sparse.coo_matrix(
+            (np.ones(2 * len(edges)), (np.concatenate([self.src, self.tgt]),
+                                       np.concatenate([self.tgt, self.src]))),
+            shape=(n_nodes, n_nodes)).tocsr()
+        self.degrees = np.diff(self.adjacency.indptr)
+
+        # Disease names and communities already stored in the graph, if any
+        self.names = np.full(n_nodes, None, dtype=object)
+        if "disease" in edges:
+            self.names[self.tgt] = edges["disease"].to_numpy()
+        self.stored_communities = None
+        if "sourceCommunity" in edges and "targetCommunity" in edges:
+            stored = np.full(n_nodes, np.nan)
+            stored[self.src] = pd.to_numeric(edges["sourceCommunity"], errors="coerce")
+            stored[self.tgt] = pd.to_numeric(edges["targetCommunity"], errors="coerce")
+            if not np.isnan(stored).all():
+                self.stored_communities = stored
+
+        self.component_ids = None
+        self.community_ids = None
+
+    @classmethod
+    def from_neo4j(cls, conn):
+        """Pull the edge list once, conn is the notebook's Neo4jConnection."""
+        return cls(pd.DataFrame(conn.query(cls.query_edges),
+                                columns=["source", "target", "disease",
+                                         "sourceCommunity", "targetCommunity"]), conn)
+
+    @classmethod
+    def from_csv(cls, relationships_file, entities_file=None):
+        """Build from case_has_disease.csv (and disease_entities.csv for the names)."""
+        rels = pd.read_csv(relationships_file).rename(
+            columns={"patient_id": "source", "entity_id": "target"})
+        if entities_file is not None:
+            names = pd.read_csv(entities_file).drop_duplicates(subset="entity_id")
+            rels["disease"] = rels["target"].map(names.set_index("entity_id")["text"])
+        return cls(rels[[c for c in ("source", "target", "disease") if c in rels]])
+
+    #### Statistics ####
+
+    def basic_stats(self):
+        """Graph overview: patients, diseases and relationships."""
+        return pd.DataFrame([{
+            "total_patients": self.n_patients,
+            "total_diseases": len(self.node_ids) - self.n_patients,
+            "total_relationships": len(self.src),
+        }])
+
+    def degree_distribution(self):
+        """Patient morbidity distribution (the number of diseases per patient)."""
+        counts = np.bincount(self.degrees[self.is_patient])
+        disease_count = np.flatnonzero(counts)
+        return pd.DataFrame({"disease_count": disease_count,
+                             "patient_count": counts[disease_count]})
+
+    def top_diseases(self, n=10):
+        """Top diseases by patient count."""
+        diseases = np.flatnonzero(~self.is_patient)
+        order = diseases[np.argsort(-self.degrees[diseases], kind="stable")[:n]]
+        return pd.DataFrame({"disease": self.names[order],
+                             "patient_count": self.degrees[order]})
+
+    #### Components and communities ####
+
+    def components(self):
+        """Weakly connected components, componentId 0 is the largest."""
+        _, labels = connected_components(self.adjacency, directed=False)
+        self.component_ids = _relabel_by_size(labels)
+        sizes = np.bincount(self.component_ids)
+        return {"componentCount": len(sizes),
+                "componentDistribution": {"max": int(sizes.max()), "min": int(sizes.min()),
+                                          "mean": float(sizes.mean())},
+                "sizes": sizes}
+
+    def label_propagation(self, mask, max_iter=100):
+        """
+        Label propagation communities of the nodes in mask. Patients and diseases are
+        updated in alternating half-steps (the graph is bipartite, so a synchronous
+        update would oscillate); a node keeps its label when it is among the most
+        frequent neighbor labels, other ties go to the smallest label.
+        """
+        n_nodes = len(self.node_ids)
+        labels = np.arange(n_nodes)
+        sub = self.adjacency[mask][:, mask]
+        sub_nodes = np.flatnonzero(mask)
+        sub_labels = labels[sub_nodes]
+        sides = [np.flatnonzero(self.is_patient[sub_nodes]), np.flatnonzero(~self.is_patient[sub_nodes])]
+
+        for _ in range(max_iter):
+            changed = 0
+            for side in sides:
+                if not len(side):
+                    continue
+                one_hot = sparse.csr_matrix((np.ones(len(sub_labels)), (np.arange(len(sub_labels)), sub_labels)),
+                                            shape=(len(sub_labels), n_nodes))
+                counts = (sub[side] @ one_hot).tocsr()
+                best = np.asarray(counts.argmax(axis=1)).ravel()
+                best_count = np.asarray(counts.max(axis=1).todense()).ravel()
+                current_count = np.asarray(counts[np.arange(len(side)), sub_labels[side]]).ravel()
+                update = (best_count > current_count) & (best_count > 0)
+                changed += int(update.sum())
+                sub_labels[side[update]] = best[update]
+            if not changed:
+                break
+
+        labels[sub_nodes] = sub_labels
+        return labels
+
+    def communities(self, method="auto", component=0):
+        """
+        Community of every node of a component (-1 elsewhere), communityId 0 the largest.
+        method: 'stored' uses the communityId already in the graph (e.g. Leiden from GDS),
+        'label_propagation' computes them locally, 'auto' prefers the stored ones.
+        """
+        if self.component_ids is None:
+            self.components()
+        mask = self.component_ids == component if component is not None else np.ones(len(self.node_ids), dtype=bool)
+
+        if method == "auto":
+            method = "stored" if self.stored_communities is not None else "label_propagation"
+        if method == "stored":
+            if self.stored_communities is None:
+                raise ValueError("No communityId stored in the graph")
+            # Keep the stored ids
+            self.community_ids = np.where(np.isnan(self.stored_communities), -1,
+                                          self.stored_communities).astype(np.int64)
+            return self.community_ids
+        if method != "label_propagation":
+            raise ValueError("method must be 'auto', 'stored' or 'label_propagation'")
+
+        labels = self.label_propagation(mask)
+        self.community_ids = _relabel_by_size(labels, mask)
+        return self.community_ids
+
+    def community_stats(self):
+        """
+        Size, conductance and diseases of each community.
+        Conductance as in gds.conductance: edges leaving the community over
+        all edges of its nodes (cut / volume).
+        """
+        comm = self.community_ids
+        valid = comm >= 0
+        ids = np.unique(comm[valid])
+        n_comms = ids.max() + 1 if len(ids) else 0
+
+        volume = np.bincount(comm[valid], weights=self.degrees[valid], minlength=n_comms)
+        cs, ct = comm[self.src], comm[self.tgt]
+        internal = (cs == ct) & (cs >= 0)
+        internal_edges = np.bincount(cs[internal], minlength=n_comms)
+        cut = volume - 2 * internal_edges
+
+        patients = np.bincount(comm[valid & self.is_patient], minlength=n_comms)
+        totals = np.bincount(comm[valid], minlength=n_comms)
+
+        # Disease names per community
+        order = np.flatnonzero(valid & ~self.is_patient)
+        diseases = {c: [] for c in ids}
+        for node in order:
+            diseases[comm[node]].append(self.names[node])
+
+        df = pd.DataFrame({
+            "communityId": ids,
+            "totalNodes": totals[ids],
+            "patientNodes": patients[ids],
+            "diseaseNodes": totals[ids] - patients[ids],
+            "conductance": np.divide(cut[ids], volume[ids], out=np.zeros(len(ids)), where=volume[ids] > 0),
+            "diseases": [diseases[c] for c in ids],
+        })
+        return df.sort_values("totalNodes", ascending=False, kind="stable").reset_index(drop=True)
+
+    def fiedler_values(self, k=4, n_workers=None):
+        """λ₂ of each community, as FiedlerComputer.compute_all_communities."""
+        comm = self.community_ids
+        intra = (comm[self.src] == comm[self.tgt]) & (comm[self.src] >= 0)
+        records = [{"communityId": c, "source": s, "target": t}
+                   for c, s, t in zip(comm[self.src[intra]].tolist(),
+                                      self.node_ids[self.src[intra]], self.node_ids[self.tgt[intra]])]
+        computer = FiedlerComputer(None)
+        solved = computer.solve_partitions(computer.partition_edges(records), k, n_workers)
+        results = [{"communityId": comm_id, "lambda_2": round(lambda_2, 2)}
+                   for comm_id, _, lambda_2, _ in sorted(solved, key=lambda s: s[0])
+                   if lambda_2 is not None]
+        return pd.DataFrame(results, columns=["communityId", "lambda_2"])
+
+    #### Write-back ####
+
+    def write_back(self, conn=None, batch_size=50000):
+        """Write componentId and communityId to the nodes, one UNWIND batch per label
+        (split in batch_size rows for very large graphs)."""
+        conn = conn or self.conn
+        community = self.community_ids if self.community_ids is not None else np.full(len(self.node_ids), -1)
+        rows = pd.DataFrame({
+            "id": self.node_ids,
+            "componentId": self.component_ids,
+            "communityId": community,
+        }).astype(object)
+        # No communityId outside the analysed component
+        rows.loc[community < 0, "communityId"] = None
+        records = rows.to_dict("records")
+
+        for query, selected in [(self.query_write_patients, self.is_patient),
+                                (self.query_write_diseases, ~self.is_patient)]:
+            batch = [records[i] for i in np.flatnonzero(selected)]
+            for start in range(0, len(batch), batch_size):
+                conn.query(query, parameters={"rows": batch[start:start + batch_size]})
+        print(f"Wrote componentId/communityId to {len(records)} nodes")
+
+    def run(self, method="auto", k=4, n_workers=None, write=False):
+        """Components, communities of the largest component, their statistics and λ₂."""
+        components = self.components()
+        self.communities(method)
+        stats = self.community_stats()
+        stats = stats.merge(self.fiedler_values(k, n_workers), on="communityId", how="left")
+        if write:
+            self.write_back()
+        return {"components": components, "communities": stats}
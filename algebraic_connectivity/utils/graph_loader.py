@@ -0,0 +1,216 @@
+"""Bulk loading of the NER outputs into the patient-disease graph"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+
+def read_ner_outputs(output_dir, cases_file="cases.csv",
+                     entities_file="disease_entities.csv",
+                     relationships_file="case_has_disease.csv"):
+    """Read the three tables written by run_ner_pipeline."""
+    return (pd.read_csv(os.path.join(output_dir, cases_file)),
+            pd.read_csv(os.path.join(output_dir, entities_file)),
+            pd.read_csv(os.path.join(output_dir, relationships_file)))
+
+
+def to_records(df):
+    """DataFrame rows as dictionaries, with None instead of NaN (not stored by Neo4j)."""
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def _bucket(values, n_buckets):
+    """Stable hash bucket of each id."""
+    return np.array([zlib.crc32(str(v).encode("utf-8")) % n_buckets for v in values], dtype=np.int64)
+
+
+class GraphLoader:
+    """
+    Loads cases.csv, disease_entities.csv and case_has_disease.csv into Neo4j.
+
+    The uniqueness constraints (and their indexes) on Patient.patient_id and
+    Disease.entity_id are created first, so that every MERGE is an index lookup.
+    Nodes are merged in parallel UNWIND batches. Relationships are merged in rounds:
+    patients and diseases are hashed into n_workers buckets each, and within a round
+    every worker takes a different (patient bucket, disease bucket) cell, so parallel
+    transactions never lock the same nodes.
+    """
+
+    constraint_queries = [
+        "CREATE CONSTRAINT patient_id IF NOT EXISTS FOR (p:Patient) REQUIRE p.patient_id IS UNIQUE",
+        "CREATE CONSTRAINT entity_id IF NOT EXISTS FOR (d:Disease) REQUIRE d.entity_id IS UNIQUE",
+    ]
+
+    patient_query = """
+    UNWIND $rows AS row
+    MERGE (p:Patient {patient_id: row.patient_id})
+    SET p += row
+    """
+
+    disease_query = """
+    UNWIND $rows AS row
+    MERGE (d:Disease {entity_id: row.entity_id})
+    SET d += row
+    """
+
+    relationship_query = """
+    UNWIND $rows AS row
+    MATCH (p:Patient {{patient_id: row.patient_id}})
+    MATCH (d:Disease {{entity_id: row.entity_id}})
+    MERGE (p)-[:{rel_type}]->(d)
+    """
+
+    def __init__(self, driver, database="neo4j", batch_size=1000, n_workers=4):
+        """driver: neo4j.Driver, e.g. the driver of the notebook's Neo4jConnection."""
+        self.driver = driver
+        self.database = database
+        self.batch_size = batch_size
+        self.n_workers = n_workers
+
+    def create_constraints(self):
+        """Create the uniqueness constraints and wait for their indexes to be online."""
+        with self.driver.session(database=self.database) as session:
+            for query in self.constraint_queries:
+                session.run(query).consume()
+            session.run("CALL db.awaitIndexes()").consume()
+
+    def _write_batch(self, query, rows):
+        """Write one batch of rows in its own managed write transaction.
+        The driver retries the transaction function on transient errors."""
+
+        def work(tx):
+            tx.run(query, {"rows": rows}).consume()
+
+        with self.driver.session(database=self.database) as session:
+            session.execute_write(work)
+        return len(rows)
+
+    def _write_parallel(self, query, batches):
+        """Write independent batches on n_workers parallel sessions."""
+        if self.n_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+                return sum(executor.map(lambda rows: self._write_batch(query, rows), batches))
+        return sum(self._write_batch(query, rows) for rows in batches)
+
+    def _batches(self, records):
+        return [records[start:start + self.batch_size]
+                for start in range(0, len(records), self.batch_size)]
+
+    def load_nodes(self, query, df, key):
+        """Merge one row per key, the other columns become properties."""
+        records = to_records(df.drop_duplicates(subset=key))
+        return self._write_parallel(query, self._batches(records))
+
+    def load_relationships(self, df):
+        """Merge the relationships, one relationship type per relation_type value."""
+        loaded = 0
+        n_buckets = max(1, self.n_workers)
+        for rel_type, rels in df.groupby("relation_type", sort=False):
+            if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", str(rel_type)):
+                raise ValueError(f"Invalid relationship type: {rel_type}")
+            query = self.relationship_query.format(rel_type=rel_type)
+            rels = rels[["patient_id", "entity_id"]].drop_duplicates()
+            patient_bucket = _bucket(rels["patient_id"], n_buckets)
+            disease_bucket = _bucket(rels["entity_id"], n_buckets)
+
+            # Round r: cell (b, (b + r) % n_buckets) for every bucket b
+            for r in range(n_buckets):
+                cells = []
+                for b in range(n_buckets):
+                    cell = rels[(patient_bucket == b) & (disease_bucket == (b + r) % n_buckets)]
+                    if len(cell):
+                        cells.append(cell)
+                # Each worker handles its whole cell, batch after batch
+                loaded += self._write_parallel_cells(query, cells)
+        return loaded
+
+    def _write_parallel_cells(self, query, cells):
+        """Write the cells of a round in parallel, the batches of a cell sequentially."""
+        def write_cell(cell):
+            return sum(self._write_batch(query, rows) for rows in self._batches(to_records(cell)))
+
+        if self.n_workers > 1 and len(cells) > 1:
+            with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+                return sum(executor.map(write_cell, cells))
+        return sum(write_cell(cell) for cell in cells)
+
+    def load(self, cases, diseases, relationships):
+        """
+        Create the constraints and load the three tables.
+        Returns the number of rows loaded per table and the seconds.
+        """
+        start_time = time.perf_counter()
+        self.create_constraints()
+        stats = {
+            "patients": self.load_nodes(self.patient_query, cases, "patient_id"),
+            "diseases": self.load_nodes(self.disease_query, diseases, "entity_id"),
+            "relationships": self.load_relationships(relationships),
+        }
+        stats["seconds"] = time.perf_counter() - start_time
+        print(f"Loaded {stats['patients']} patients, {stats['diseases']} diseases and "
+              f"{stats['relationships']} relationships in {stats['seconds']:.2f}s")
+        return stats
+
+
+#### neo4j-admin import ####
+
+def _admin_header(df, id_column, id_space):
+    """neo4j-admin import header: the id column and typed properties."""
+    columns = {}
+    for column, dtype in df.dtypes.items():
+        if column == id_column:
+            columns[column] = f"{column}:ID({id_space})"
+        elif pd.api.types.is_bool_dtype(dtype):
+            columns[column] = f"{column}:boolean"
+        elif pd.api.types.is_integer_dtype(dtype):
+            columns[column] = f"{column}:long"
+        elif pd.api.types.is_float_dtype(dtype):
+            columns[column] = f"{column}:double"
+        else:
+            columns[column] = column
+    return columns
+
+
+def export_admin_import(cases, diseases, relationships, output_dir, database="neo4j"):
+    """
+    Write neo4j-admin import CSVs for an offline bulk import into an empty database.
+    Relationships whose patient or disease is missing are dropped.
+    Returns the file paths and the import command.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    patients = cases.drop_duplicates(subset="patient_id")
+    diseases = diseases.drop_duplicates(subset="entity_id")
+
+    rels = relationships.drop_duplicates(subset=["patient_id", "entity_id", "relation_type"])
+    valid = rels["patient_id"].isin(patients["patient_id"]) & rels["entity_id"].isin(diseases["entity_id"])
+    if not valid.all():
+        print(f"Dropped {int((~valid).sum())} relationships with missing nodes")
+    rels = rels[valid]
+
+    paths = {
+        "patients": os.path.join(output_dir, "patients_nodes.csv"),
+        "diseases": os.path.join(output_dir, "diseases_nodes.csv"),
+        "relationships": os.path.join(output_dir, "has_disease_relationships.csv"),
+    }
+    (patients.rename(columns=_admin_header(patients, "patient_id", "Patient"))
+             .assign(**{":LABEL": "Patient"})
+             .to_csv(paths["patients"], index=False))
+    (diseases.rename(columns=_admin_header(diseases, "entity_id", "Disease"))
+             .assign(**{":LABEL": "Disease"})
+             .to_csv(paths["diseases"], index=False))
+    (rels[["patient_id", "entity_id", "relation_type"]]
+         .set_axis([":START_ID(Patient)", ":END_ID(Disease)", ":TYPE"], axis=1)
+         .to_csv(paths["relationships"], index=False))
+
+    paths["command"] = (
+        f"neo4j-admin database import full --multiline-fields=true "
+        f"--nodes={paths['patients']} --nodes={paths['diseases']} "
+        f"--relationships={paths['relationships']} {database}"
+    )
+    print(f"Wrote neo4j-admin import files to {output_dir}:\n{paths['command']}")
+    return paths
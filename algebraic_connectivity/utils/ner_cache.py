@@ -0,0 +1,92 @@
+"""Content-addressed cache of NER results and memoized entity IDs"""
+
+from functools import lru_cache
+import hashlib
+import json
+import sqlite3
+
+from utils.ner_dedup import clean_entity_text
+
+
+@lru_cache(maxsize=None)
+def create_entity_id(entity_text: str, entity_type: str) -> str:
+    """
+    Generate a short unique ID for an entity based on normalized text and
+    entity type. Memoized, the same entities come back for every note.
+    """
+    normalized = clean_entity_text(entity_text)
+    key = f"{normalized}_{entity_type}".encode("utf-8")
+    text_hash = hashlib.md5(key).hexdigest()[:8]
+    return f"{entity_type[:3].upper()}_{text_hash}"
+
+
+def note_hash(text):
+    """Content hash of a clinical note."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class NERCache:
+    """
+    Persistent NER results keyed by (model name, note hash, confidence threshold,
+    minimum length), stored in a single SQLite file. Unchanged notes get their
+    stored entities back instead of a new inference, whatever their patient_id.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS ner_cache (key TEXT PRIMARY KEY, entities TEXT NOT NULL)")
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def key(model_name, digest, min_confidence, min_length):
+        """Cache key of a note (given by its note_hash) for a model and the filtering thresholds."""
+        raw = f"{model_name}\x00{digest}\x00{min_confidence!r}\x00{min_length!r}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        """{key: entities} of the stored keys, entities as [entity_group, text, score]."""
+        found = {}
+        keys = list(keys)
+        # Stay below the SQLite host parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, entities FROM ner_cache WHERE key IN ({placeholders})", chunk)
+            found.update((key, json.loads(entities)) for key, entities in rows)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Store (key, entities) pairs, entities as returned by filter_entities."""
+        rows = [(key, json.dumps([[e["entity_group"], e["text"], e["score"]] for e in entities]))
+                for key, entities in items]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO ner_cache VALUES (?, ?)", rows)
+
+    @staticmethod
+    def to_entities(cached, patient_id, model_type):
+        """Rebuild the filter_entities records of a note from the cached entities."""
+        return [{
+            "patient_id": patient_id,
+            "entity_group": entity_group,
+            "text": text,
+            "score": score,
+            "model_type": model_type,
+        } for entity_group, text, score in cached]
+
+    def __len__(self):
+        return self.conn.execute("SELECT count(*) FROM ner_cache").fetchone()[0]
@@ -0,0 +1,250 @@
+"""Blocked fuzzy deduplication of NER entity mentions"""
+
+from collections import Counter, defaultdict
+
+import numpy as np
+from rapidfuzz.fuzz import ratio
+from rapidfuzz.process import cpdist
+from scipy import sparse
+
+
+def clean_entity_text(text):
+    """Normalize entity text."""
+    if isinstance(text, dict):
+        # If text is a dict (e.g., from pipeline output), extract its string value
+        text = text.get("word") or text.get("text") or str(text)
+    elif not isinstance(text, str):
+        text = str(text)
+
+    normalized = text.strip().lower().replace("\n", " ").replace("  ", " ")
+    normalized = " ".join(normalized.split())
+    return normalized
+
+
+class UnionFind:
+    """Disjoint sets over 0..n-1 with path halving and union by size, growable."""
+
+    def __init__(self):
+        self.parent = []
+        self.size = []
+
+    def add(self):
+        """Add a singleton set and return its index."""
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        return len(self.parent) - 1
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x, y):
+        rx, ry = self.find(x), self.find(y)
+        if rx == ry:
+            return
+        if self.size[rx] < self.size[ry]:
+            rx, ry = ry, rx
+        self.parent[ry] = rx
+        self.size[rx] += self.size[ry]
+
+
+class _GroupIndex:
+    """
+    Unique texts of one entity group with their mention statistics,
+    a sparse q-gram count matrix for candidate blocking and the union-find clusters.
+    """
+
+    def __init__(self, q):
+        self.q = q
+        self.texts = []
+        self.ids = {}
+        self.clusters = UnionFind()
+        # q-gram counts as growing CSR arrays
+        self.vocabulary = {}
+        self.indptr = [0]
+        self.indices = []
+        self.counts = []
+        self._matrix = None
+        # Mention statistics per unique text
+        self.mentions = []
+        self.score_sums = []
+        self.originals = []
+        self.patient_ids = []
+
+    def qgrams(self, text):
+        """Multiset of the q-grams of the padded text."""
+        pad = "#" * (self.q - 1)
+        padded = pad + text + pad
+        return Counter(padded[i:i + self.q] for i in range(len(padded) - self.q + 1))
+
+    def add_text(self, text):
+        """Add a new unique text, returns its id."""
+        text_id = self.clusters.add()
+        self.ids[text] = text_id
+        self.texts.append(text)
+        for gram, count in self.qgrams(text).items():
+            self.indices.append(self.vocabulary.setdefault(gram, len(self.vocabulary)))
+            self.counts.append(count)
+        self.indptr.append(len(self.indices))
+        self._matrix = None
+        self.mentions.append(0)
+        self.score_sums.append(0.0)
+        self.originals.append(Counter())
+        self.patient_ids.append(set())
+        return text_id
+
+    def matrix(self):
+        """Texts x q-grams count matrix."""
+        if self._matrix is None:
+            self._matrix = sparse.csr_matrix(
+                (np.array(self.counts, dtype=np.float32), self.indices, self.indptr),
+                shape=(len(self.texts), len(self.vocabulary)))
+        return self._matrix
+
+    def candidate_pairs(self, first_id, threshold, chunk_size):
+        """
+        Yields index arrays (i, j), j < i and i >= first_id, of the pairs that can reach
+        the threshold. ratio >= threshold bounds the Indel distance by
+        d_max = (1 - threshold/100)(la + lb), which gives a length filter and
+        a q-gram count filter: shared q-grams >= max(|Qa|, |Qb|) - q * d_max.
+        The dot product of the count vectors is an upper bound of the shared q-grams,
+        so no matching pair is filtered out.
+        """
+        X = self.matrix()
+        lengths = np.fromiter((len(t) for t in self.texts), dtype=np.float64, count=len(self.texts))
+        slack = 1 - threshold / 100
+        # Length blocks: only texts of compatible length are multiplied
+        by_length = np.argsort(lengths, kind="stable")
+        sorted_lengths = lengths[by_length]
+        new_ids = first_id + np.argsort(lengths[first_id:], kind="stable")
+        for start in range(0, len(new_ids), chunk_size):
+            rows = new_ids[start:start + chunk_size]
+            lo = lengths[rows[0]] * threshold / (200 - threshold)
+            hi = lengths[rows[-1]] * (200 - threshold) / threshold
+            window = by_length[np.searchsorted(sorted_lengths, lo, "left"):
+                               np.searchsorted(sorted_lengths, hi, "right")]
+            window = window[window < rows.max()]
+            if not len(window):
+                continue
+            shared = (X[rows] @ X[window].T).tocoo()
+            i = rows[shared.row]
+            j = window[shared.col]
+            la, lb = lengths[i], lengths[j]
+            keep = ((j < i)
+                    # Length filter: ratio <= 200 * min(la, lb) / (la + lb)
+                    & (200 * np.minimum(la, lb) >= threshold * (la + lb))
+                    & (shared.data >= np.maximum(la, lb) + self.q - 1 - self.q * slack * (la + lb)))
+            yield i[keep], j[keep]
+
+    def link(self, first_id, threshold, chunk_size):
+        """Score the texts from first_id on against their candidates and merge the matches."""
+        texts = self.texts
+        for i, j in self.candidate_pairs(first_id, threshold, chunk_size):
+            if not len(i):
+                continue
+            # Pairwise scores computed in C
+            scores = cpdist([texts[k] for k in i], [texts[k] for k in j],
+                            scorer=ratio, score_cutoff=threshold, workers=-1)
+            matched = scores >= threshold
+            for a, b in zip(i[matched].tolist(), j[matched].tolist()):
+                self.clusters.union(a, b)
+
+
+class EntityDeduplicator:
+    """
+    Sub-quadratic replacement of the full cdist deduplication of fuzzy_match_entities.
+
+    Identical normalized texts are collapsed first, candidate pairs are blocked with a
+    q-gram inverted index plus length and count filters (no pair that can reach the
+    threshold is missed), only candidates are scored with RapidFuzz ratio and a score
+    cutoff, and clusters are the connected components of the matches (union-find),
+    so they do not depend on the input order. New batches of mentions can be added
+    at any time; only their new unique texts are scored.
+    """
+
+    def __init__(self, similarity_threshold=85, q=3, chunk_size=1024):
+        """chunk_size: texts per block of the sparse q-gram products, bounds the memory."""
+        self.similarity_threshold = similarity_threshold
+        self.q = q
+        self.chunk_size = chunk_size
+        self.groups = {}
+
+    def add(self, entities_list):
+        """Add a batch of entity mentions (NER pipeline records)."""
+        first_ids = {}
+        for e in entities_list:
+            raw_text = e.get('word') or e.get('text') or ''
+            text = clean_entity_text(raw_text)
+            entity_type = e.get('entity_group', 'UNKNOWN')
+            group = self.groups.setdefault(entity_type, _GroupIndex(self.q))
+
+            text_id = group.ids.get(text)
+            if text_id is None:
+                text_id = group.add_text(text)
+                first_ids.setdefault(entity_type, text_id)
+
+            group.mentions[text_id] += 1
+            group.score_sums[text_id] += float(e.get('score', 0.0))
+            group.originals[text_id][raw_text.strip()] += 1
+            if e.get('patient_id'):
+                group.patient_ids[text_id].add(e.get('patient_id'))
+
+        # Only the new unique texts are scored, against all the indexed ones
+        for entity_type, first_id in first_ids.items():
+            self.groups[entity_type].link(first_id, self.similarity_threshold, self.chunk_size)
+        return self
+
+    def _members(self, group):
+        """Unique text ids per cluster root."""
+        members = defaultdict(list)
+        for text_id in range(len(group.texts)):
+            members[group.clusters.find(text_id)].append(text_id)
+        return members.values()
+
+    def _summaries(self):
+        """(entity_group, unique text ids, deduplicated entity) per cluster."""
+        for entity_type, group in self.groups.items():
+            for ids in self._members(group):
+                originals = Counter()
+                patient_ids = set()
+                for text_id in ids:
+                    originals.update(group.originals[text_id])
+                    patient_ids |= group.patient_ids[text_id]
+                n_mentions = sum(group.mentions[text_id] for text_id in ids)
+
+                yield entity_type, ids, {
+                    'text': min((group.texts[text_id] for text_id in ids), key=lambda t: (len(t), t)),
+                    # Most frequent original, ties broken alphabetically
+                    'canonical_text': min(originals.items(), key=lambda kv: (-kv[1], kv[0]))[0],
+                    'entity_group': entity_type,
+                    'score': sum(group.score_sums[text_id] for text_id in ids) / n_mentions,
+                    'merged_mentions': n_mentions,
+                    'patient_count': len(patient_ids),
+                }
+
+    def clusters(self):
+        """Deduplicated entities, in the format of fuzzy_match_entities."""
+        results = [record for _, _, record in self._summaries()]
+        return sorted(results, key=lambda x: x['score'], reverse=True)
+
+    def canonical_map(self):
+        """{(normalized text, entity_group): canonical_text} for every indexed text,
+        not only the representative text of each cluster."""
+        mapping = {}
+        for entity_type, ids, record in self._summaries():
+            texts = self.groups[entity_type].texts
+            for text_id in ids:
+                mapping[(texts[text_id], entity_type)] = record['canonical_text']
+        return mapping
+
+
+def fuzzy_match_entities(entities_list, similarity_threshold=85):
+    """
+    Deduplicate entities using RapidFuzz fuzzy matching.
+    """
+    if not entities_list:
+        return []
+    return EntityDeduplicator(similarity_threshold).add(entities_list).clusters()
@@ -0,0 +1,296 @@
+"""Batched, streaming NER inference with on-disk checkpointing"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import gc
+import glob
+import itertools
+import json
+import os
+
+import torch
+from tqdm.auto import tqdm
+from transformers import pipeline
+
+from utils.ner_cache import note_hash
+from utils.ner_dedup import clean_entity_text
+
+
+@lru_cache(maxsize=None)
+def load_pipeline(model_name, device):
+    """Load a NER pipeline once per process and model."""
+    return pipeline(
+        task="ner",
+        model=model_name,
+        aggregation_strategy="average",
+        device=device
+        )
+
+
+def release_pipelines():
+    """Free the loaded pipelines (and the GPU memory)."""
+    load_pipeline.cache_clear()
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def filter_entities(ents, patient_id, model_type, min_confidence, min_length):
+    """Confidence and length filtering of the pipeline output of one note."""
+    entities = []
+    for ent in ents:
+        # Get the cleaned text first
+        raw_text = ent.get("word") or ent.get("text") or ""
+        entity_text = clean_entity_text(raw_text)
+
+        # Confidence filtering
+        if ent.get("score", 0.0) < min_confidence:
+            continue
+
+        # Length filtering
+        if len(entity_text) <= min_length:
+            continue
+
+        entities.append({
+            "patient_id": patient_id,
+            "entity_group": str(ent.get("entity_group", "UNKNOWN")).upper(),
+            "text": entity_text,
+            "score": float(ent.get("score", 0.0)),
+            "model_type": model_type,
+        })
+    return entities
+
+
+def _infer_batch(task):
+    """
+    Worker: run the pipeline on one batch of notes.
+    task = (model_name, device, batch_size, cases, model_type, min_confidence, min_length)
+    Returns one {patient_id, note_hash, entities, error} record per note.
+    """
+    model_name, device, batch_size, cases, model_type, min_confidence, min_length = task
+    ner_pipeline = load_pipeline(model_name, device)
+    texts = [case.get("clinical_note", "") for case in cases]
+
+    try:
+        outputs = ner_pipeline(texts, batch_size=batch_size)
+        errors = [None] * len(cases)
+    except Exception:
+        # Isolate the failing note(s)
+        outputs, errors = [], []
+        for text in texts:
+            try:
+                outputs.append(ner_pipeline(text))
+                errors.append(None)
+            except Exception as e:
+                outputs.append([])
+                errors.append(str(e))
+
+    records = []
+    for case, ents, error in zip(cases, outputs, errors):
+        cid = case.get("patient_id")
+        records.append({
+            "patient_id": cid,
+            "note_hash": note_hash(case.get("clinical_note", "")),
+            "entities": filter_entities(ents, cid, model_type, min_confidence, min_length),
+            "error": error,
+        })
+    return records
+
+
+def _init_worker(n_threads):
+    """Split the CPU threads between the worker processes."""
+    torch.set_num_threads(n_threads)
+
+
+class NERInference:
+    """
+    Batched NER inference of one model over the clinical notes.
+
+    Notes are sent to the transformers pipeline in batches of batch_size; on CPU the
+    batches can be spread over n_workers processes, each loading the model once.
+    The results stream to sharded JSONL files (one line per note with its entities),
+    which are also the checkpoint: a new run skips the (patient_id, note hash) pairs
+    already stored, so a crash only loses the batches in flight and an edited note
+    is processed again. With a NERCache, unchanged notes get their stored entities
+    back and only the new or edited notes are inferred.
+    """
+
+    def __init__(self, model_config, model_type, config, output_dir,
+                 batch_size=16, n_workers=1, shard_size=5000, cache=None):
+        """
+        model_config: entry of Config.MODELS, config: the pipeline Config
+        output_dir: directory of the shards of this model
+        shard_size: notes per shard file
+        cache: optional NERCache shared across runs
+        """
+        self.model_name = model_config["model_name"]
+        self.model_type = model_type
+        self.device = config.DEVICE
+        self.min_confidence = config.MIN_CONFIDENCE
+        self.min_length = config.MIN_LENGTH
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        # A single process drives the GPU
+        self.n_workers = n_workers if self.device < 0 else 1
+        self.shard_size = shard_size
+        self.cache = cache
+
+    #### Shards ####
+
+    def shard_paths(self):
+        """Shard files in write order."""
+        return sorted(glob.glob(os.path.join(self.output_dir, "part-*.jsonl")))
+
+    def iter_records(self, cases=None):
+        """
+        Stream the stored note records, skipping a line truncated by a crash.
+        cases: only the records of these notes, leaving out the stale records
+        of notes edited since they were processed
+        """
+        current = None
+        if cases is not None:
+            current = {(case.get("patient_id"), note_hash(case.get("clinical_note", "")))
+                       for case in cases}
+        for path in self.shard_paths():
+            with open(path) as fp:
+                for line in fp:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if current is None or (record["patient_id"], record.get("note_hash")) in current:
+                        yield record
+
+    def iter_entities(self, cases=None):
+        """Stream the stored entities, in the format of run_ner_model."""
+        for record in self.iter_records(cases):
+            yield from record["entities"]
+
+    def completed_keys(self):
+        """(patient_id, note hash) pairs already processed."""
+        return {(record["patient_id"], record.get("note_hash")) for record in self.iter_records()}
+
+    #### Inference ####
+
+    def _batches(self, cases):
+        for start in range(0, len(cases), self.batch_size):
+            yield (self.model_name, self.device, self.batch_size,
+                   cases[start:start + self.batch_size], self.model_type,
+                   self.min_confidence, self.min_length)
+
+    def _store_in_cache(self, results, keys):
+        """Pass the inference results through, storing the successful notes in the cache.
+        keys: cache keys of the inferred notes, in the order of the results."""
+        keys = iter(keys)
+        for records in results:
+            # records first: zip must not consume a key past the end of the batch
+            self.cache.put_many([(key, record["entities"])
+                                 for record, key in zip(records, keys) if not record["error"]])
+            yield records
+
+    def run(self, cases):
+        """
+        Run the model on all the notes that are not already stored.
+        cases: list of {patient_id, clinical_note} records
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        done = self.completed_keys()
+        hashes = [note_hash(case.get("clinical_note", "")) for case in cases]
+        pending = [(case, digest) for case, digest in zip(cases, hashes)
+                   if (case.get("patient_id"), digest) not in done]
+
+        print(f"\n{'='*90}")
+        print(f"Processing with {self.model_type.upper()} model: {self.model_name}")
+        print(f"{len(done)} notes already processed, {len(pending)} to process")
+
+        # Notes found in the cache skip the inference
+        cached_records = []
+        if self.cache is not None:
+            # One key per note, by position: patient_ids may repeat with different notes
+            keys = [self.cache.key(self.model_name, digest, self.min_confidence, self.min_length)
+                    for _, digest in pending]
+            cached = self.cache.get_many(set(keys))
+            misses, miss_keys = [], []
+            for (case, digest), key in zip(pending, keys):
+                cid = case.get("patient_id")
+                if key in cached:
+                    cached_records.append({
+                        "patient_id": cid,
+                        "note_hash": digest,
+                        "entities": self.cache.to_entities(cached[key], cid, self.model_type),
+                        "error": None,
+                    })
+                else:
+                    misses.append((case, digest))
+                    miss_keys.append(key)
+            pending = misses
+            print(f"{len(cached_records)} notes found in the cache, {len(pending)} to infer")
+        print(f"{'='*90}")
+        pending = [case for case, _ in pending]
+
+        # Always start a new shard, a previous run may have left a truncated line
+        shard = len(self.shard_paths())
+        in_shard = 0
+        fp = None
+        stats = {"notes": 0, "entities": 0, "errors": 0}
+
+        if self.n_workers > 1 and pending:
+            n_threads = max(1, (os.cpu_count() or 1) // self.n_workers)
+            executor = ProcessPoolExecutor(max_workers=self.n_workers,
+                                           initializer=_init_worker, initargs=(n_threads,))
+            results = executor.map(_infer_batch, self._batches(pending))
+        else:
+            executor = None
+            results = map(_infer_batch, self._batches(pending))
+        if self.cache is not None:
+            results = self._store_in_cache(results, miss_keys)
+        if cached_records:
+            results = itertools.chain([cached_records], results)
+
+        try:
+            with tqdm(total=len(pending) + len(cached_records), desc=f"{self.model_type} NER") as progress:
+                for records in results:
+                    for record in records:
+                        if record["error"]:
+                            print(f"Error on {record['patient_id']}: {record['error']}")
+                            stats["errors"] += 1
+                            # Not checkpointed, retried by the next run
+                            continue
+                        # Shards are only created for records to write
+                        if fp is None or in_shard >= self.shard_size:
+                            if fp is not None:
+                                fp.close()
+                            fp = open(os.path.join(self.output_dir, f"part-{shard:05d}.jsonl"), "a")
+                            shard += 1
+                            in_shard = 0
+                        fp.write(json.dumps({"patient_id": record["patient_id"],
+                                             "note_hash": record["note_hash"],
+                                             "entities": record["entities"]}) + "\n")
+                        in_shard += 1
+                        stats["notes"] += 1
+                        stats["entities"] += len(record["entities"])
+                    if fp is not None:
+                        fp.flush()
+                    progress.update(len(records))
+        finally:
+            if fp is not None:
+                fp.close()
+            if executor is not None:
+                executor.shutdown()
+            else:
+                # The model was loaded in this process
+                release_pipelines()
+
+        return stats
+
+
+def run_ner_model(cases, model_config, model_type, config, output_dir,
+                  batch_size=16, n_workers=1, shard_size=5000, cache=None):
+    """
+    Run a NER model on clinical notes and return entities and scores.
+    The entities are checkpointed to output_dir, see NERInference.
+    """
+    inference = NERInference(model_config, model_type, config, output_dir,
+                             batch_size, n_workers, shard_size, cache)
+    inference.run(cases)
+    return list(inference.iter_entities(cases))
@@ -0,0 +1,182 @@
+"""Batch validation and timed execution of Cypher statements"""
+
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import re
+import time
+import neo4j
+from neo4j.exceptions import Neo4jError
+import pandas as pd
+
+# Import local modules
+from utils.neo4j_conn import Neo4jGraph
+
+#### Executors ####
+
+# Leading whitespace and comments, then the optional CYPHER version/options prefix
+LEADING_COMMENTS = re.compile(r"(?:\s+|//[^\n]*|/\*.*?\*/)*", re.DOTALL)
+CYPHER_PREFIX = re.compile(r"CYPHER(?:\s+(?:\d+(?:\.\d+)?|\w+\s*=\s*\w+))*(?=\s)", re.IGNORECASE)
+
+def statement_body(cypher_query: str) -> str:
+    """The statement without its leading comments and CYPHER prefix."""
+    text = cypher_query[LEADING_COMMENTS.match(cypher_query).end():]
+    prefix = CYPHER_PREFIX.match(text)
+    if prefix:
+        text = text[prefix.end():]
+        text = text[LEADING_COMMENTS.match(text).end():]
+    return text
+
+def first_keyword(cypher_query: str) -> str:
+    """First keyword of the statement body, upper case."""
+    keyword = re.match(r"[A-Za-z_]+", statement_body(cypher_query))
+    return keyword.group(0).upper() if keyword else ""
+
+class Neo4jExecutor:
+    """Runs EXPLAIN and timed executions against a Neo4j instance
+    (e.g. a local Neo4j container) through a Neo4jGraph connection."""
+
+    def __init__(self, graph: Neo4jGraph) -> None:
+        self.graph = graph
+
+    def _session(self) -> neo4j.Session:
+        return self.graph._driver.session(database=self.graph._database)
+
+    def explain(self, cypher_query: str) -> None:
+        """Plans the statement without running it, raises on invalid statements."""
+        keyword = first_keyword(cypher_query)
+        if keyword == "PROFILE":
+            # PROFILE would run the statement, plan it only
+            body = statement_body(cypher_query)
+            cypher_query = cypher_query[:len(cypher_query) - len(body)] + "EXPLAIN" + body[len(keyword):]
+        elif keyword != "EXPLAIN":
+            cypher_query = "EXPLAIN " + cypher_query
+        with self._session() as session:
+            session.run(cypher_query).consume()
+
+    def execute(self,
+                cypher_query: str,
+                timeout: Optional[float] = None,
+                ) -> int:
+        """Runs the statement in a read transaction and returns the number of rows."""
+        def work(tx):
+            # Count while streaming, the rows are not kept
+            return sum(1 for _ in tx.run(cypher_query))
+
+        with self._session() as session:
+            if timeout is None:
+                return session.execute_read(work)
+            return session.execute_read(neo4j.unit_of_work(timeout=timeout)(work))
+
+class StubExecutor:
+    """Embedded stand-in for offline runs: structural checks only
+    (known leading clause after the comments and CYPHER prefix,
+    balanced brackets and quotes), no rows."""
+
+    clauses = ("MATCH", "OPTIONAL", "WITH", "UNWIND", "CALL", "RETURN",
+               "CREATE", "MERGE", "EXPLAIN", "PROFILE", "USE",
+               "SET", "REMOVE", "DELETE", "DETACH", "NODETACH", "FOREACH",
+               "LOAD", "SHOW", "TERMINATE", "FINISH", "FILTER", "LET", "INSERT",
+               "ALTER", "DROP", "GRANT", "DENY", "REVOKE", "RENAME",
+               "START", "STOP", "ENABLE")
+
+    def explain(self, cypher_query: str) -> None:
+        text = statement_body(cypher_query).strip()
+        first = first_keyword(text)
+        if first not in self.clauses:
+            raise SyntaxError(f"Invalid input '{first or text[:1]}'")
+        # Ignore the content of the string literals
+        stripped = re.sub(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"", "''", text)
+        if stripped.count("'") % 2 or stripped.count('"') % 2:
+            raise SyntaxError("Unbalanced quotes")
+        pairs = {")": "(", "]": "[", "}": "{"}
+        stack = []
+        for char in stripped:
+            if char in "([{":
+                stack.append(char)
+            elif char in pairs:
+                if not stack or stack.pop() != pairs[char]:
+                    raise SyntaxError(f"Unbalanced '{char}'")
+        if stack:
+            raise SyntaxError(f"Unbalanced '{stack[-1]}'")
+
+    def execute(self,
+                cypher_query: str,
+                timeout: Optional[float] = None,
+                ) -> int:
+        return 0
+
+#### Validation ####
+
+def error_class(error: Exception) -> str:
+    """Short error class: the last part of the Neo4j status code
+    (e.g. SyntaxError, UnknownFunction), else the exception name."""
+    code = getattr(error, "code", None)
+    if isinstance(error, Neo4jError) and code:
+        return code.split(".")[-1]
+    return type(error).__name__
+
+class CypherValidator:
+    """
+    Validates a batch of Cypher statements in parallel. Every statement is checked
+    with EXPLAIN and, optionally, executed with a timeout. The results table has one
+    row per statement with its latencies, row count and error class.
+    """
+
+    def __init__(self,
+                 executor: Any,
+                 max_workers: int = 8,
+                 execute: bool = False,
+                 timeout: Optional[float] = 10.0,
+                 ) -> None:
+        """executor is a Neo4jExecutor or a StubExecutor."""
+        self.executor = executor
+        self.max_workers = max_workers
+        self.execute = execute
+        self.timeout = timeout
+
+    def validate_one(self, item: Tuple[int, str]) -> Dict[str, Any]:
+        """Validates one (index, statement) pair."""
+        idx, cypher_query = item
+        result = {"index": idx, "cypher": cypher_query, "valid": False,
+                  "error_class": None, "error": None,
+                  "explain_ms": None, "execute_ms": None, "rows": None}
+
+        stage = "explain_ms"
+        try:
+            start = time.perf_counter()
+            self.executor.explain(cypher_query)
+            result["explain_ms"] = 1000 * (time.perf_counter() - start)
+
+            if self.execute:
+                stage = "execute_ms"
+                start = time.perf_counter()
+                result["rows"] = self.executor.execute(cypher_query, self.timeout)
+                result["execute_ms"] = 1000 * (time.perf_counter() - start)
+            result["valid"] = True
+        except Exception as e:
+            result[stage] = 1000 * (time.perf_counter() - start)
+            result["error_class"] = error_class(e)
+            result["error"] = str(e)
+        return result
+
+    def validate(self, cypher_queries: List[str]) -> pd.DataFrame:
+        """Validates all the statements, the results keep the input order."""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(self.validate_one, enumerate(cypher_queries)))
+        elapsed = time.perf_counter() - start
+
+        df = pd.DataFrame(results)
+        print(f"Validated {len(df)} statements in {elapsed:.2f}s, "
+              f"{int(df['valid'].sum()) if len(df) else 0} valid.")
+        return df
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    """Counts and mean latencies per error class (valid statements under 'OK')."""
+    classes = results["error_class"].fillna("OK")
+    return (results.assign(error_class=classes)
+                   .groupby("error_class")
+                   .agg(count=("index", "size"),
+                        explain_ms=("explain_ms", "mean"),
+                        execute_ms=("execute_ms", "mean"))
+                   .sort_values("count", ascending=False))
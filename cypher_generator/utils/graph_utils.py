@@ -1,23 +1,161 @@
 """Functions to extract information from structured_schema"""
 
-from typing import Any, List, Union
+from typing import Any, List, Union, Mapping, Tuple
+from types import MappingProxyType
+from collections import OrderedDict
+import copy
+import hashlib
+import json
 import re
+import threading
 from neo4j import time
 from Levenshtein import distance
 
 # Import local modules
 from utils.utilities import *
 
+#### COMPILED SCHEMA INDEX ####
+
+class LabelMatcher:
+    """BK-tree over node labels for approximate matching by Levenshtein distance.
+
+    A query only visits the subtrees whose edge distance lies in
+    [d - max_dist, d + max_dist], and each distance is computed with a
+    score_cutoff so that it stops early once it exceeds the bound.
+    """
+
+    def __init__(self, labels: List[str]) -> None:
+        # Position of each label, used to return matches in schema order
+        self._order = {label: i for i, label in enumerate(labels)}
+        # Tree nodes are [label, {edge_distance: child}]
+        self._root = None
+        for label in labels:
+            self._add(label)
+
+    def _add(self, label: str) -> None:
+        if self._root is None:
+            self._root = [label, {}]
+            return
+        node = self._root
+        while True:
+            d = distance(label, node[0])
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = [label, {}]
+                return
+            node = child
+
+    def match(self, 
+              entity: str, 
+              max_dist: int
+              ) -> List[str]:
+        """Returns the labels at Levenshtein distance <= max_dist, in schema order."""
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            label, children = stack.pop()
+            # Exact distance is needed to prune children, bound it by the subtree span
+            max_edge = max(children) if children else 0
+            d = distance(entity, label, score_cutoff=max_dist + max_edge)
+            if d <= max_dist:
+                found.append(label)
+            for edge, child in children.items():
+                if d - max_dist <= edge <= d + max_dist:
+                    stack.append(child)
+        return sorted(found, key=self._order.__getitem__)
+
+class SchemaIndex(Mapping):
+    """Immutable index of a structured_schema, built once.
+
+    Behaves like the structured_schema dictionary (keys 'node_props', 'rel_props',
+    'relationships'), so it can be passed wherever jschema is expected. The helpers
+    in this module detect it and replace their scans by dictionary lookups:
+    - label -> properties, and label -> datatype -> properties
+    - rel type -> datatype -> properties
+    - label -> incident relationships
+    """
+
+    def __init__(self, jschema: Dict) -> None:
+        self._jschema = MappingProxyType(dict(jschema))
+        # Content hash, identifies the schema version in caches
+        self.version = hashlib.sha256(
+            json.dumps(dict(jschema), sort_keys=True, default=str).encode("utf-8")
+            ).hexdigest()[:16]
+
+        node_props = jschema['node_props']
+        rel_props = jschema['rel_props']
+        relationships = jschema['relationships']
+
+        self.nodes: Tuple[str, ...] = tuple(node_props.keys())
+        self.node_properties = MappingProxyType(
+            {label: tuple(el['property'] for el in props) 
+             for label, props in node_props.items()})
+        self.node_properties_by_datatype = MappingProxyType(
+            {label: MappingProxyType(self._group_by_datatype(props)) 
+             for label, props in node_props.items()})
+        self.rel_properties_by_datatype = MappingProxyType(
+            {rel: MappingProxyType(self._group_by_datatype(props)) 
+             for rel, props in rel_props.items()})
+
+        datatypes = set()
+        for props in node_props.values():
+            datatypes.update(el['datatype'] for el in props)
+        self.datatypes = frozenset(datatypes)
+
+        # Positions of the incident relationships, in schema order
+        incident = {}
+        for i, rel in enumerate(relationships):
+            incident.setdefault(rel['start'], []).append(i)
+            if rel['end'] != rel['start']:
+                incident.setdefault(rel['end'], []).append(i)
+        self.incident_relationship_ids = MappingProxyType(
+            {label: tuple(ids) for label, ids in incident.items()})
+        self.incident_relationships = MappingProxyType(
+            {label: tuple(relationships[i] for i in ids) for label, ids in incident.items()})
+
+        self.label_matcher = LabelMatcher(list(self.nodes))
+
+        self.formatted_relationships: Tuple[str, ...] = tuple(
+            f"(:{el['start']})-[:{el['type']}]->(:{el['end']})" for el in relationships)
+
+    @staticmethod
+    def _group_by_datatype(props: List[Dict]
+                           ) -> Dict[str, Tuple[str, ...]]:
+        """Groups a list of {property, datatype} by datatype."""
+        grouped = {}
+        for el in props:
+            grouped.setdefault(el['datatype'], []).append(el['property'])
+        return {datatype: tuple(names) for datatype, names in grouped.items()}
+
+    def __getitem__(self, key: str) -> Any:
+        return self._jschema[key]
+
+    def __iter__(self):
+        return iter(self._jschema)
+
+    def __len__(self) -> int:
+        return len(self._jschema)
+
+def compile_schema(jschema: Dict
+                   ) -> SchemaIndex:
+    """Builds the SchemaIndex of a structured_schema (no-op if already compiled)."""
+    if isinstance(jschema, SchemaIndex):
+        return jschema
+    return SchemaIndex(jschema)
+
 def retrieve_datatypes(jschema: Dict
                        ) -> Any:
     """Retrieves the set of datatypes present in the graph."""
-    all_types = []
-    all_nodes = get_nodes_list(jschema)
-    for label in all_nodes:
-        node_info = jschema['node_props'][label]
-        node_types = [el['datatype'] for el in node_info]
-        all_types = all_types + node_types
-    return set(all_types)
+    if isinstance(jschema, SchemaIndex):
+        return set(jschema.datatypes)
+    all_types = set()
+    for node_info in jschema['node_props'].values():
+        all_types.update(el['datatype'] for el in node_info)
+    return all_types
 
 
 #### NODES ####
@@ -25,6 +163,8 @@ def retrieve_datatypes(jschema: Dict
 def get_nodes_list(jschema: Dict
                    ) -> List[str]:
     """Returns the list of node labels in the graph."""
+    if isinstance(jschema, SchemaIndex):
+        return list(jschema.nodes)
     return list(jschema['node_props'].keys())
 
 def get_node_properties(jschema: Dict,
@@ -34,6 +174,13 @@ def get_node_properties(jschema: Dict,
                         ) -> Any:
     """Function to extract a list of properties for a given node.
     Options to return the datatypes or a properties of specific datatype only."""
+
+    if isinstance(jschema, SchemaIndex):
+        if not datatypes:
+            return list(jschema.node_properties[label])
+        if len(datatype) > 1:
+            return list(jschema.node_properties_by_datatype[label].get(datatype, ()))
+        return jschema['node_props'][label]
    
     node_info = jschema['node_props'][label]
     if datatypes:
@@ -67,7 +214,9 @@ def extract_relationships_list(jschema: Dict,
     formatted=True - each relationship is a string: (:start)-[:type]->(:end)
     formatted=False - each relationship is a dictionary with keys: start, type, end.
     """
-    if formatted:
+    if formatted and isinstance(jschema, SchemaIndex):
+        rels_list = list(jschema.formatted_relationships)
+    elif formatted:
         rels_list=[]
         for el in jschema['relationships']:
             formatted_rels = f"(:{el['start']})-[:{el['type']}]->(:{el['end']})" 
@@ -88,6 +237,10 @@ def get_relationships_properties_of_datatype(jschema: Dict,
                                              datatype: str
                                              ) -> List[Any]:
     """Extracts relationships properties of specified datatype."""
+    if isinstance(jschema, SchemaIndex):
+        return [{rel: list(by_type[datatype])} 
+                for rel, by_type in jschema.rel_properties_by_datatype.items() 
+                if datatype in by_type]
     outputs = []
     for rel in list(jschema['rel_props'].keys()):
         props = jschema['rel_props'][rel]
@@ -206,6 +359,144 @@ def filter_relationships_instances(jschema: Dict,
                 result.append([label_start, selected_start, rel, label_end, selected_end])
     return result
 
+#### CACHED INSTANCE STORE ####
+
+class InstanceStore:
+    """
+    Typed cache of sampled node and relationship instances.
+
+    Temporals are converted once, at ingest: the properties whose schema datatype
+    is temporal first, then any other neo4j.time value (a property sampled with
+    another type, a label missing from the schema). Node instances are indexed by label, and the
+    parsed outputs are memoized per (label, datatype) and per (start, end)
+    datatype pair, so repeated datatype-specific parsing is a lookup.
+    The store can be saved to and loaded from a json file.
+    """
+
+    temporal_datatypes = ("DATE", "DATE_TIME", "LOCAL_DATE_TIME")
+
+    def __init__(self, jschema: Dict) -> None:
+        self.schema = compile_schema(jschema)
+        self.nodes: Dict[str, List[Dict]] = {}
+        self.relationships: List[Dict] = []
+        self._node_parsed: Dict[Tuple[str, str], List[Any]] = {}
+        self._rels_parsed: Dict[Tuple[str, str], List[Any]] = {}
+        self._temporal: Dict[Tuple[str, bool], List[str]] = {}
+
+    def _temporal_keys(self, 
+                       label: str, 
+                       relationship: bool = False
+                       ) -> List[str]:
+        """Properties of a node label (or rel type) with a temporal datatype."""
+        key = (label, relationship)
+        if key not in self._temporal:
+            by_datatype = (self.schema.rel_properties_by_datatype if relationship 
+                           else self.schema.node_properties_by_datatype)
+            by_type = by_datatype.get(label, {})
+            self._temporal[key] = [prop for datatype in self.temporal_datatypes 
+                                   for prop in by_type.get(datatype, ())]
+        return self._temporal[key]
+
+    @staticmethod
+    def _convert_value(d: Dict, key: str) -> None:
+        value = d[key]
+        if isinstance(value, time.Date):
+            d[key] = neo4j_date_to_string(value)
+        elif isinstance(value, time.DateTime):
+            d[key] = neo4j_datetime_to_string(value)
+
+    def _convert(self, 
+                 d: Dict, 
+                 label: str, 
+                 relationship: bool = False
+                 ) -> Dict:
+        """Converts the temporal properties of one instance."""
+        temporal_keys = self._temporal_keys(label, relationship)
+        # Fast path: the properties with a temporal schema datatype
+        for key in temporal_keys:
+            if key in d:
+                self._convert_value(d, key)
+        # Fallback: temporals the schema does not announce
+        if len(d) > len(temporal_keys):
+            for key in d:
+                if key not in temporal_keys:
+                    self._convert_value(d, key)
+        return d
+
+    def add_nodes(self, instances_nodes: List[List[Dict]]) -> None:
+        """Ingests the output of Neo4jSchema.extract_node_instances."""
+        for sublist in instances_nodes:
+            for rec in sublist:
+                label = rec['Instance']['Label']
+                props = self._convert(rec['Instance']['properties'], label)
+                self.nodes.setdefault(label, []).append(props)
+        self._node_parsed.clear()
+
+    def add_relationships(self, instances_rels: List[List[Dict]]) -> None:
+        """Ingests the output of Neo4jSchema.extract_multiple_relationships_instances."""
+        for coll in instances_rels:
+            for instance in coll:
+                triple = list(instance.keys())
+                self._convert(instance[triple[0]], triple[0][:-6])
+                self._convert(instance[triple[1]], triple[1], relationship=True)
+                self._convert(instance[triple[2]], triple[2][:-4])
+                self.relationships.append(instance)
+        self._rels_parsed.clear()
+
+    def node_instances(self, label: str) -> List[Dict]:
+        """Stored property dictionaries of a node label."""
+        return self.nodes.get(label, [])
+
+    def parse_label_datatype(self, 
+                             label: str, 
+                             datatype: str
+                             ) -> List[Any]:
+        """[[label, property, value], ...] for the properties of given datatype."""
+        key = (label, datatype)
+        if key not in self._node_parsed:
+            props_label = self.schema.node_properties_by_datatype.get(label, {}).get(datatype, ())
+            parsed = []
+            if props_label:
+                for props in self.node_instances(label):
+                    parsed_dict = extract_subdict(props, props_label)
+                    parsed.extend([label, k, v] for k, v in parsed_dict.items() if k and v)
+            self._node_parsed[key] = parsed
+        return self._node_parsed[key]
+
+    def parse_node_instances_datatype(self,
+                                      nodes: List[str],
+                                      datatype: str,
+                                      ) -> List[Any]:
+        """Cached parse_node_instances_datatype, same output format."""
+        return flatten_list([self.parse_label_datatype(label, datatype) for label in nodes])
+
+    def filter_relationships_instances(self,
+                                       datatype_start: str,
+                                       datatype_end: str
+                                       ) -> List[Any]:
+        """Cached filter_relationships_instances, same output format."""
+        key = (datatype_start, datatype_end)
+        if key not in self._rels_parsed:
+            self._rels_parsed[key] = filter_relationships_instances(
+                self.schema, [self.relationships], datatype_start, datatype_end)
+        return self._rels_parsed[key]
+
+    def save(self, file_path: str) -> None:
+        """Writes the converted instances to a json file."""
+        write_json({"nodes": self.nodes, "relationships": self.relationships}, file_path)
+
+    @classmethod
+    def load(cls, 
+             jschema: Dict, 
+             file_path: str
+             ) -> "InstanceStore":
+        """Reads a store saved with save()."""
+        data = read_json(file_path)
+        store = cls(jschema)
+        store.nodes = data["nodes"]
+        store.relationships = data["relationships"]
+        return store
+
 #### EXTRACT LOCAL GRAPH INFO ####
 
 def get_graph_neighborhood(jschema: Dict,
@@ -215,8 +506,12 @@ def get_graph_neighborhood(jschema: Dict,
     """
     Extracts all node labels, their properties and corresponding relationships information 
     that are at a certain Levenshtein distance from a given string or contain the given string. 
-    To speed up the process the schema file is used.
+    To speed up the process the schema file is used. With a SchemaIndex the labels
+    are matched through its BK-tree and the relationships through its adjacency map.
     """
+
+    if isinstance(jschema, SchemaIndex):
+        return _get_graph_neighborhood_indexed(jschema, entity, lev_dist)
     
     node_properties = jschema['node_props'] 
     nodes = list(node_properties.keys())
@@ -241,6 +536,30 @@ def get_graph_neighborhood(jschema: Dict,
 
     return local_nodes_properties, local_relationships_properties, local_relationships
 
+def _get_graph_neighborhood_indexed(index: SchemaIndex,
+                                    entity: str,
+                                    lev_dist: int,
+                                    ) -> Union[List[Any], List[Any], List[Any]]:
+    """get_graph_neighborhood on a SchemaIndex, same outputs."""
+
+    relationships = index['relationships']
+
+    # Get a list of similar node labels
+    local_nodes = index.label_matcher.match(entity, lev_dist)
+    local_nodes_properties = extract_subdict(index['node_props'], local_nodes)
+
+    # Relationships incident to the local nodes, in schema order and without repeats
+    rel_ids = set()
+    for label in local_nodes:
+        rel_ids.update(index.incident_relationship_ids.get(label, ()))
+    local_relationships = [relationships[i] for i in sorted(rel_ids)
+                           if not isinstance(relationships[i].get('type'), dict)]
+
+    local_relationships_types = [e['type'] for e in local_relationships]
+    local_relationships_properties = extract_subdict(index['rel_props'], local_relationships_types)
+
+    return local_nodes_properties, local_relationships_properties, local_relationships
+
 def get_subgraph_schema(jschema: Dict,
                         entities: List[str], 
                         lev_dist: int,
@@ -265,16 +584,17 @@ def get_subgraph_schema(jschema: Dict,
         "relationships": subgraph_relationships,
         }
 
-    # Format local node properties
+    # Format local node properties, without repeats
     formatted_local_nodes_props = []
     for entry in subgraph_nodes:
-        node = list(entry.keys())[0]
-        props_str = ", ".join(
-            [f"{el['property']}: {el['datatype']}"  for el in entry[node]]
-            )
-        formatted_local_nodes_props.append(f"{node} {{{props_str}}}")
+        for node in entry:
+            props_str = ", ".join(
+                [f"{el['property']}: {el['datatype']}"  for el in entry[node]]
+                )
+            formatted_local_nodes_props.append(f"{node} {{{props_str}}}")
+    formatted_local_nodes_props = list(dict.fromkeys(formatted_local_nodes_props))
 
-    # Format local relationship properties
+    # Format local relationship properties, without repeats
     formatted_local_rel_props = []
     for sublist in subgraph_relationships_properties:
         for rel in list(sublist.keys()):
@@ -282,14 +602,16 @@ def get_subgraph_schema(jschema: Dict,
                 [f"{el['property']}: {el['datatype']}" for el in sublist[rel]]
                 )
             formatted_local_rel_props.append(f"{rel} {{{props_str}}}")
+    formatted_local_rel_props = list(dict.fromkeys(formatted_local_rel_props))
 
-    # Format local relationships
+    # Format local relationships, without repeats
     formatted_local_rels = []
     for sublist in subgraph_relationships:
         formatted_rel = [
             f"(:{el['start']})-[:{el['type']}]->(:{el['end']})" for el in sublist
         ]
         formatted_local_rels.extend(formatted_rel)
+    formatted_local_rels = list(dict.fromkeys(formatted_local_rels))
     
     subschema = "\n".join(
         [
@@ -307,6 +629,108 @@ def get_subgraph_schema(jschema: Dict,
     else:
         return structured_subschema
 
+#### CACHED SUBSCHEMAS ####
+
+class SubschemaCache:
+    """Bounded LRU cache for get_subgraph_schema outputs.
+
+    The key is (schema version, entities, lev_dist, formatted). The formatted
+    subschema only depends on the first occurrence of each entity, so its key keeps
+    the entities deduplicated in the caller's order; the structured subschema has one
+    entry per entity and is keyed by the entities as given. Plain structured_schema
+    dictionaries are compiled once per object, they must not be mutated afterwards.
+    Keeps hit/miss counters, safe to use from several threads.
+    """
+
+    def __init__(self, maxsize: int = 256, max_schemas: int = 8) -> None:
+        self.maxsize = maxsize
+        self.max_schemas = max_schemas
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # id(jschema) -> (jschema, SchemaIndex), the reference keeps the id valid
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _compile(self, jschema: Dict) -> SchemaIndex:
+        """compile_schema, memoized per schema object."""
+        if isinstance(jschema, SchemaIndex):
+            return jschema
+        with self._lock:
+            entry = self._indexes.get(id(jschema))
+            if entry is not None and entry[0] is jschema:
+                self._indexes.move_to_end(id(jschema))
+                return entry[1]
+        index = compile_schema(jschema)
+        with self._lock:
+            self._indexes[id(jschema)] = (jschema, index)
+            while len(self._indexes) > self.max_schemas:
+                self._indexes.popitem(last=False)
+        return index
+
+    def get_subgraph_schema(self,
+                            jschema: Dict,
+                            entities: List[str],
+                            lev_dist: int,
+                            formatted: bool=True,
+                            ) -> Union[str, Dict]:
+        """Cached get_subgraph_schema, same output as the uncached call."""
+
+        index = self._compile(jschema)
+        if formatted:
+            # Repeated entities do not change the formatted subschema
+            normalized = tuple(dict.fromkeys(entities))
+        else:
+            normalized = tuple(entities)
+        key = (index.version, normalized, lev_dist, formatted)
+
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._copy(self._entries[key])
+            self.misses += 1
+
+        result = get_subgraph_schema(index, list(normalized), lev_dist, formatted)
+
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return self._copy(result)
+
+    @staticmethod
+    def _copy(result: Union[str, Dict]) -> Union[str, Dict]:
+        """Strings are immutable, structured subschemas are copied."""
+        return result if isinstance(result, str) else copy.deepcopy(result)
+
+    def cache_info(self) -> Dict[str, int]:
+        """Returns the hits, misses, current size and maxsize."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._entries), "maxsize": self.maxsize}
+
+    def clear(self) -> None:
+        """Empties the cache and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._indexes.clear()
+            self.hits = 0
+            self.misses = 0
+
+# Shared cache used by get_subgraph_schema_cached
+subschema_cache = SubschemaCache()
+
+def get_subgraph_schema_cached(jschema: Dict,
+                               entities: List[str], 
+                               lev_dist: int,
+                               formatted: bool=True,
+                               ) -> Union[str, Dict]:
+    """get_subgraph_schema through the shared LRU subschema_cache."""
+    return subschema_cache.get_subgraph_schema(jschema, entities, lev_dist, formatted)
+
+
 
    
 
@@ -0,0 +1,174 @@
+"""Asyncio graph database connector and concurrent schema sampling"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+import asyncio
+import neo4j
+from neo4j.exceptions import CypherSyntaxError
+
+# Import local modules
+from utils.neo4j_schema import (meta_data_query, parse_meta_data, format_schema,
+                                node_instances_query, relationship_instances_query)
+
+
+class AsyncNeo4jGraph:
+    """Asyncio Neo4j wrapper for graph operations, the counterpart of Neo4jGraph.
+    At most max_concurrency queries are in flight at the same time."""
+
+    def __init__(
+        self,
+        url: str,
+        username: str,
+        password: str,
+        database: str = "neo4j",
+        max_concurrency: int = 8,
+        ) -> None:
+        """Create a new async Neo4j graph wrapper instance.
+        Call 'await verify_connectivity()' to check the connection."""
+        self._driver = neo4j.AsyncGraphDatabase.driver(url,
+                                                        auth=(username, password))
+        self._database = database
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def verify_connectivity(self) -> None:
+        """Verify the connection."""
+        try:
+            await self._driver.verify_connectivity()
+        except neo4j.exceptions.ServiceUnavailable:
+            raise ValueError(
+                "Could not connect to Neo4j database. "
+                "Please ensure that the url is correct."
+            )
+        except neo4j.exceptions.AuthError:
+            raise ValueError(
+                "Could not connect to Neo4j database. "
+                "Please ensure that the username and password are correct."
+            )
+
+    async def close(self) -> None:
+        """Closes the Neo4j connection."""
+        if self._driver is not None:
+            await self._driver.close()
+
+    async def query(self,
+                    cypher_query: str,
+                    params: Optional[dict] = None
+                    ) -> List[Dict[str, Any]]:
+        """Query Neo4j database, each query runs on its own session."""
+
+        async with self._semaphore:
+            async with self._driver.session(database=self._database) as session:
+                try:
+                    data = await session.run(cypher_query, params or {})
+                    return [r.data() async for r in data]
+                except CypherSyntaxError as e:
+                    raise ValueError(
+                        "Cypher Statement is not valid\n" f"{e}")
+
+    async def query_many(self,
+                         statements: Sequence[Union[str, Tuple[str, dict]]],
+                         ) -> List[List[Dict[str, Any]]]:
+        """Run a list of statements concurrently, the results keep the input order.
+        Each statement is a query string or a (query, params) tuple."""
+        statements = [(s, {}) if isinstance(s, str) else s for s in statements]
+        return await asyncio.gather(*[self.query(*s) for s in statements])
+
+
+class AsyncNeo4jSchema:
+    """Asyncio counterpart of Neo4jSchema: schema extraction and
+    concurrent sampling of node and relationship instances."""
+
+    def __init__(
+        self,
+        url: str,
+        username: str,
+        password: str,
+        max_concurrency: int = 8,
+        ) -> None:
+        """Create an async Neo4j graph wrapper instance.
+        Use 'await AsyncNeo4jSchema.create(...)' to also extract the schema."""
+
+        self.url=url
+        self.username=username
+        self.password=password
+        self.conn = AsyncNeo4jGraph(url, username, password,
+                                    max_concurrency=max_concurrency)
+        self.schema: str = ""
+        self.structured_schema: Dict[str, Any] = {}
+
+    @classmethod
+    async def create(cls,
+                     url: str,
+                     username: str,
+                     password: str,
+                     max_concurrency: int = 8,
+                     ) -> "AsyncNeo4jSchema":
+        """Create the instance, verify the connection and build the schema."""
+        self = cls(url, username, password, max_concurrency)
+        await self.conn.verify_connectivity()
+        try:
+            await self.build_schema()
+        except neo4j.exceptions.ClientError:
+            raise ValueError(
+                "Could not use APOC procedures. "
+                "Please ensure the APOC plugin is installed in Neo4j and that "
+                "'apoc.meta.data()' is allowed in Neo4j configuration "
+            )
+        return self
+
+    async def close(self) -> None:
+        """Closes the Neo4j connection."""
+        await self.conn.close()
+
+    #### Schema Utilities ####
+
+    @property
+    def get_schema(self) -> str:
+        """Returns the schema as a string."""
+        return self.schema
+
+    @property
+    def get_structured_schema(self) -> Dict[str, Any]:
+        """Returns the schema as a json object."""
+        return self.structured_schema
+
+    async def build_schema(self) -> None:
+        """Build KG schema as a string or as a json object."""
+
+        rows = await self.conn.query(meta_data_query)
+        node_properties, rel_properties, relationships = parse_meta_data(rows)
+
+        self.structured_schema, self.schema = format_schema(
+            node_properties, rel_properties, relationships)
+
+    #### Instances Utilities ####
+
+    async def extract_node_instances(self,
+                                     selected_labels: List[str],
+                                     n: int) -> List[Any]:
+        """
+        Function to extract node instances: attributes & values.
+        The labels are sampled concurrently."""
+        return await self.conn.query_many(
+            [(node_instances_query(label), {'n': n, 'label': label})
+             for label in selected_labels])
+
+    async def extract_relationship_instances(self,
+                                             rel: Dict,
+                                             n: int,
+                                             ) -> List[Any]:
+        """
+        Function to extract instances for a given relationship, written as a triple.
+        The data includes properties for both nodes and relationship (if any).
+        """
+        query_rels = relationship_instances_query(rel['start'], rel['type'], rel['end'])
+        return await self.conn.query(query_rels, {'n': n})
+
+    async def extract_multiple_relationships_instances(self,
+                                                       rtriples: List[Any],
+                                                       n: int,
+                                                       ) -> List[Any]:
+        """Extracts n instances of each from a relationships list.
+        The triples are sampled concurrently."""
+        return await self.conn.query_many(
+            [(relationship_instances_query(rtriple['start'], rtriple['type'], rtriple['end']),
+              {'n': n}) for rtriple in rtriples])
@@ -2,7 +2,11 @@
 
 """Functions to extract specific KG information and data using Cypher"""
 
-from typing import Any, List, Iterable
+from typing import Any, List, Iterable, Optional, Tuple
+import hashlib
+import os
+from functools import lru_cache
+import neo4j
 import pandas as pd
 
 # Import local modules
@@ -35,6 +39,119 @@ rel_properties_query = """
     RETURN {type: nodeLabels, properties: properties} AS output
     """
 
+# Single introspection pass, all the schema structures are derived from it
+meta_data_query = """
+    CALL apoc.meta.data()
+    YIELD label, other, elementType, type, property
+    RETURN label, other, elementType, type, property
+    """
+
+# Database identity and a cheap change fingerprint (count store statistics)
+schema_fingerprint_query = """
+    CALL db.info() YIELD id, name
+    CALL apoc.meta.stats() YIELD labels, relTypesCount
+    RETURN id, name, labels, relTypesCount
+    """
+
+@lru_cache(maxsize=None)
+def node_instances_query(label: str
+                         ) -> str:
+    """Cypher template to sample instances of a node label, built once per label.
+    Labels cannot be parameters, the limit is the $n parameter and the text
+    is identical for every call, so the server reuses the cached plan."""
+    return f"""MATCH (p:`{label}`) 
+                WITH p LIMIT $n
+                RETURN {{Label: $label, properties: properties(p)}} AS Instance
+                """
+
+@lru_cache(maxsize=None)
+def relationship_instances_query(start: str,
+                                 rel_type: str,
+                                 end: str,
+                                 ) -> str:
+    """Cypher template to sample instances of a relationship triple, built once
+    per triple. The limit is the $n parameter."""
+    return f"""MATCH (a:`{start}`)-[r:`{rel_type}`]->(b:`{end}`) 
+                RETURN a AS `{start}_Start`, properties(r) AS `{rel_type}`, b AS `{end}_End`   
+                LIMIT $n """
+
+#### Schema formatting ####
+
+def parse_meta_data(rows: List[Dict]
+                    ) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    """Derive the node properties, relationship properties and relationships
+    from the rows of a single apoc.meta.data() call. The outputs have the same
+    format as node_properties_query, rel_properties_query and rel_query."""
+
+    node_props: Dict[str, List[Dict]] = {}
+    rel_props: Dict[str, List[Dict]] = {}
+    relationships = []
+
+    for row in rows:
+        if row["type"] == "RELATIONSHIP":
+            if row["elementType"] == "node":
+                for other_node in row["other"]:
+                    relationships.append(
+                        {"start": row["label"], "type": row["property"], "end": str(other_node)})
+            continue
+        prop = {"property": row["property"], "datatype": row["type"]}
+        if row["elementType"] == "node":
+            node_props.setdefault(row["label"], []).append(prop)
+        elif row["elementType"] == "relationship":
+            rel_props.setdefault(row["label"], []).append(prop)
+
+    node_properties = [{"label": k, "properties": v} for k, v in node_props.items()]
+    rel_properties = [{"type": k, "properties": v} for k, v in rel_props.items()]
+
+    return node_properties, rel_properties, relationships
+
+def format_schema(node_properties: List[Dict],
+                  rel_properties: List[Dict],
+                  relationships: List[Dict],
+                  ) -> Tuple[Dict[str, Any], str]:
+    """Build the structured schema and the schema string from the outputs
+    of the node properties, relationship properties and relationships queries."""
+
+    structured_schema = {
+        "node_props": {el["label"]: el["properties"] for el in node_properties},
+        "rel_props": {el["type"]: el["properties"] for el in rel_properties},
+        "relationships": relationships,
+        }
+
+    # Format node properties
+    formatted_node_props = []
+    for el in node_properties:
+        props_str = ", ".join(
+            [f"{prop['property']}: {prop['datatype']}" for prop in el["properties"]]
+        )
+        formatted_node_props.append(f"{el['label']} {{{props_str}}}")
+
+    # Format relationship properties
+    formatted_rel_props = []
+    for el in rel_properties:
+        props_str = ", ".join(
+            [f"{prop['property']}: {prop['datatype']}" for prop in el["properties"]]
+        )
+        formatted_rel_props.append(f"{el['type']} {{{props_str}}}")
+
+    # Format relationships
+    formatted_rels = [
+        f"(:{el['start']})-[:{el['type']}]->(:{el['end']})" for el in relationships
+    ]
+
+    schema = "\n".join(
+        [
+            "Node properties are the following:",
+            ",".join(formatted_node_props),
+            "Relationship properties are the following:",
+            ",".join(formatted_rel_props),
+            "The relationships are the following:",
+            ",".join(formatted_rels),
+        ]
+    )
+
+    return structured_schema, schema
+
 class Neo4jSchema(Neo4jGraph):
     """Neo4j wrapper for graph operations."""
 
@@ -43,18 +160,25 @@ class Neo4jSchema(Neo4jGraph):
         url: str, 
         username: str, 
         password: str, 
+        cache_path: Optional[str] = None,
         ) -> None:
-        """Create a Neo4j graph wrapper instance and extract schema information."""
+        """Create a Neo4j graph wrapper instance and extract schema information.
+        If cache_path is given, the schema is stored in that json file and reused
+        while the database identity and its label/rel-type counts are unchanged."""
 
         self.url=url
         self.username=username
         self.password=password
         self.conn = Neo4jGraph(url, username, password)
+        self.cache_path = cache_path
         self.schema: str = ""
         self.structured_schema: Dict[str, Any] = {}
 
         try:
-            self.build_schema()
+            if cache_path is None:
+                self.build_schema()
+            else:
+                self.load_or_build_schema()
         except neo4j.exceptions.ClientError:
             raise ValueError(
                 "Could not use APOC procedures. "
@@ -77,48 +201,75 @@ class Neo4jSchema(Neo4jGraph):
     def build_schema(self) -> None:
         """Build KG schema as a string or as a json object."""
 
-        node_properties = [el["output"] for el in self.conn.query(node_properties_query)]
-        rel_properties = [el["output"] for el in self.conn.query(rel_properties_query)]
-        relationships = [el["output"] for el in self.conn.query(rel_query)]
-    
-        self.structured_schema = {
-            "node_props": {el["label"]: el["properties"] for el in node_properties},
-            "rel_props": {el["type"]: el["properties"] for el in rel_properties},
-            "relationships": relationships,
+        rows = self.conn.query(meta_data_query)
+        node_properties, rel_properties, relationships = parse_meta_data(rows)
+
+        self.structured_schema, self.schema = format_schema(
+            node_properties, rel_properties, relationships)
+
+    #### Schema Cache ####
+
+    def schema_fingerprint(self) -> Tuple[str, str]:
+        """Returns the database identity and a fingerprint of the
+        label and relationship type counts."""
+
+        stats = self.conn.query(schema_fingerprint_query)[0]
+        identity = f"{self.url}|{stats['id']}|{stats['name']}"
+        counts = json.dumps([stats["labels"], stats["relTypesCount"]], sort_keys=True)
+        fingerprint = hashlib.sha256(counts.encode("utf-8")).hexdigest()
+        return identity, fingerprint
+
+    def _read_cache(self) -> Dict[str, Any]:
+        """Reads the schema cache file, empty if it does not exist."""
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return {}
+        return read_json(self.cache_path)
+
+    def load_or_build_schema(self, 
+                             known: Optional[Tuple[str, str]] = None
+                             ) -> bool:
+        """Loads the schema from the cache if the fingerprint still matches,
+        else builds it and updates the cache. Returns True on a cache hit.
+        known: (identity, fingerprint) already computed by the caller."""
+
+        identity, fingerprint = known or self.schema_fingerprint()
+        cache = self._read_cache()
+        entry = cache.get(identity)
+
+        if entry is not None and entry["fingerprint"] == fingerprint:
+            self.structured_schema = entry["structured_schema"]
+            self.schema = entry["schema"]
+            return True
+
+        self.build_schema()
+        cache[identity] = {
+            "fingerprint": fingerprint,
+            "structured_schema": self.structured_schema,
+            "schema": self.schema,
             }
+        write_json(cache, self.cache_path)
+        return False
 
-        # Format node properties
-        formatted_node_props = []
-        for el in node_properties:
-            props_str = ", ".join(
-                [f"{prop['property']}: {prop['datatype']}" for prop in el["properties"]]
-            )
-            formatted_node_props.append(f"{el['label']} {{{props_str}}}")
+    def invalidate_schema_cache(self, 
+                                known: Optional[Tuple[str, str]] = None
+                                ) -> None:
+        """Removes the cached schema of this database."""
 
-        # Format relationship properties
-        formatted_rel_props = []
-        for el in rel_properties:
-            props_str = ", ".join(
-                [f"{prop['property']}: {prop['datatype']}" for prop in el["properties"]]
-            )
-            formatted_rel_props.append(f"{el['type']} {{{props_str}}}")
+        cache = self._read_cache()
+        identity, _ = known or self.schema_fingerprint()
+        if cache.pop(identity, None) is not None:
+            write_json(cache, self.cache_path)
 
-        # Format relationships
-        formatted_rels = [
-            f"(:{el['start']})-[:{el['type']}]->(:{el['end']})" for el in relationships
-        ]
-    
-        self.schema = "\n".join(
-            [
-                "Node properties are the following:",
-                ",".join(formatted_node_props),
-                "Relationship properties are the following:",
-                ",".join(formatted_rel_props),
-                "The relationships are the following:",
-                ",".join(formatted_rels),
-            ]
-        )
+    def refresh_schema(self) -> None:
+        """Invalidates the cache (if any) and rebuilds the schema."""
 
+        if self.cache_path is None:
+            self.build_schema()
+        else:
+            # One fingerprint query for both steps
+            fingerprint = self.schema_fingerprint()
+            self.invalidate_schema_cache(fingerprint)
+            self.load_or_build_schema(fingerprint)
 
     #### Instances Utilities ####
     
@@ -128,14 +279,12 @@ class Neo4jSchema(Neo4jGraph):
         """
         Function to extract node instances: attributes & values."""
         extracted = []
-        for label in selected_labels:
-            query_nodes = f"""MATCH (p:{label}) 
-                            WITH p LIMIT {n}
-                            RETURN {{Label: '{label}', properties: properties(p)}} AS Instance
-                            """
-            
-            data = self.conn.query(query_nodes)
-            extracted.append(data)
+        # One session for all the labels
+        with self.conn.reuse_session():
+            for label in selected_labels:
+                data = self.conn.query(node_instances_query(label),
+                                       {'n': n, 'label': label})
+                extracted.append(data)
 
         return extracted
         
@@ -147,12 +296,8 @@ class Neo4jSchema(Neo4jGraph):
         Function to extract instances for a given relationship, written as a triple.
         The data includes properties for both nodes and relationship (if any).
         """
-        extracted = []
-        query_rels = f"""MATCH (a:{rel['start']})-[r:{rel['type']}]->(b:{rel['end']}) 
-                        RETURN a AS {rel['start']}_Start, properties(r) AS {rel['type']}, b AS {rel['end']}_End   
-                        LIMIT {n} """
-        
-        data = self.conn.query(query_rels)
+        query_rels = relationship_instances_query(rel['start'], rel['type'], rel['end'])
+        data = self.conn.query(query_rels, {'n': n})
         return data 
     
     def extract_multiple_relationships_instances( self,
@@ -161,9 +306,11 @@ class Neo4jSchema(Neo4jGraph):
                             ) -> List[Any]:
         """Extracts n instances of each from a relationships list."""
         extracted = []
-        for rtriple in rtriples:
-            temp_list = self.extract_relationship_instances(rtriple, n)
-            extracted.append(temp_list)
+        # One session for all the triples
+        with self.conn.reuse_session():
+            for rtriple in rtriples:
+                temp_list = self.extract_relationship_instances(rtriple, n)
+                extracted.append(temp_list)
         return extracted
 
    
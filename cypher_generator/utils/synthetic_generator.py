@@ -0,0 +1,201 @@
+"""Concurrent, resumable generation of synthetic question/Cypher data"""
+
+from typing import Any, Dict, List, Optional
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import os
+import random
+import threading
+import time
+
+# Import local modules
+from utils.utilities import *
+
+#### Prompts ####
+
+def create_prompt(schema: str,
+                  category: str,
+                  n_questions: int = 40,
+                  ) -> List[Dict[str, str]]:
+    """Build and format the prompt."""
+    formatted_prompt = [
+        {"role": "system",
+        "content": "You are an experienced Cypher developer and a helpful assistant designed to output JSON!"},
+        {"role": "user",
+         "content": f"""Generate {n_questions} questions and their corresponding Cypher statements about the Neo4j graph database with the following schema:
+        {schema}
+        The questions should cover {category} and should be phrased in a natural conversational manner. Make the questions diverse and interesting.
+        Make sure to use the latest Cypher version and that all the queries are working Cypher queries for the provided graph. You may add
+        values for the node attributes as needed. Do not add any comments, do not label or number the questions.
+        """}]
+    return formatted_prompt
+
+def build_items(schema: str,
+                categories: List[str],
+                repeats: int = 1,
+                n_questions: int = 40,
+                ) -> List[Dict[str, Any]]:
+    """One generation item per category (and repeat), with a stable id."""
+    items = []
+    for i, category in enumerate(categories):
+        for r in range(repeats):
+            items.append({
+                "id": f"{i}-{r}",
+                "category": category,
+                "messages": create_prompt(schema, category, n_questions),
+                })
+    return items
+
+#### Backends ####
+
+class GenerationBackend(ABC):
+    """Interface of a model backend: takes chat messages, returns the generated text."""
+
+    @abstractmethod
+    def generate(self, messages: List[Dict[str, str]]) -> str:
+        pass
+
+class OpenAIBackend(GenerationBackend):
+    """OpenAI chat completions backend, returns JSON objects."""
+
+    def __init__(self,
+                 client: Any,
+                 model: str = "gpt-4-1106-preview",
+                 ) -> None:
+        """client is an openai.OpenAI instance."""
+        self.client = client
+        self.model = model
+
+    def generate(self, messages: List[Dict[str, str]]) -> str:
+        response = self.client.chat.completions.create(
+            model=self.model,
+            response_format={"type": "json_object"},
+            messages=messages)
+        return response.choices[0].message.content
+
+class StubBackend(GenerationBackend):
+    """Deterministic local stand-in for offline tests and benchmarks.
+    The output depends only on the messages, latency simulates the round-trip."""
+
+    def __init__(self,
+                 n_questions: int = 5,
+                 latency: float = 0.0,
+                 ) -> None:
+        self.n_questions = n_questions
+        self.latency = latency
+
+    def generate(self, messages: List[Dict[str, str]]) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        digest = hashlib.sha256(json.dumps(messages).encode("utf-8")).hexdigest()
+        rng = random.Random(digest)
+        questions = []
+        for i in range(self.n_questions):
+            limit = rng.randint(1, 20)
+            questions.append({
+                "question": f"Sample question {digest[:8]}-{i}?",
+                "cypher": f"MATCH (a:Article) RETURN a.title LIMIT {limit}",
+                })
+        return json.dumps({"questions": questions})
+
+#### Engine ####
+
+class RateLimiter:
+    """Spaces out requests to at most requests_per_minute, thread safe."""
+
+    def __init__(self, requests_per_minute: Optional[float] = None) -> None:
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Blocks until the next request slot."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class SyntheticDataGenerator:
+    """
+    Dispatches generation items concurrently with bounded parallelism and
+    rate limiting. Each result is appended to a JSONL file as soon as it arrives,
+    so a crash loses at most the line being written, and a new run skips the
+    items already on disk.
+    """
+
+    def __init__(self,
+                 backend: GenerationBackend,
+                 output_path: str,
+                 max_workers: int = 4,
+                 requests_per_minute: Optional[float] = None,
+                 ) -> None:
+        self.backend = backend
+        self.output_path = output_path
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self._write_lock = threading.Lock()
+
+    def completed_ids(self) -> set:
+        """Ids of the items already stored in the output file."""
+        if not os.path.exists(self.output_path):
+            return set()
+        return {record["id"] for record in read_jsonl(self.output_path)}
+
+    def _generate_one(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Generates one item and appends the result to the output file."""
+        self.rate_limiter.wait()
+        start = time.perf_counter()
+        output = self.backend.generate(item["messages"])
+        record = {
+            "id": item["id"],
+            "category": item.get("category"),
+            "output": output,
+            "seconds": round(time.perf_counter() - start, 3),
+            }
+        with self._write_lock:
+            append_jsonl(record, self.output_path)
+        return record
+
+    def run(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Generates all the items that are not already completed.
+        Failed items are reported and will be retried by the next run."""
+
+        if os.path.exists(self.output_path):
+            # A crash may have left a partial last line, the appends must not extend it
+            truncate_partial_line(self.output_path)
+        done = self.completed_ids()
+        pending = [item for item in items if item["id"] not in done]
+        print(f"{len(done)} items already completed, {len(pending)} to generate.")
+
+        failed = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._generate_one, item): item for item in pending}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    item_id = futures[future]["id"]
+                    print(f"Error on item {item_id}: {e}")
+                    failed.append(item_id)
+        elapsed = time.perf_counter() - start
+
+        stats = {
+            "skipped": len(done),
+            "generated": len(pending) - len(failed),
+            "failed": failed,
+            "seconds": elapsed,
+            }
+        print(f"Generated {stats['generated']} items in {elapsed:.2f}s, {len(failed)} failed.")
+        return stats
+
+    def collect_outputs(self, items: List[Dict[str, Any]]) -> List[str]:
+        """Returns the stored outputs in the order of items,
+        the same list that build_synthetic_data used to return."""
+        outputs = {record["id"]: record["output"] for record in read_jsonl(self.output_path)}
+        return [outputs[item["id"]] for item in items if item["id"] in outputs]
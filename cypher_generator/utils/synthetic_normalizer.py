@@ -0,0 +1,185 @@
+"""Normalize heterogeneous synthetic model outputs to canonical records"""
+
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+import hashlib
+import os
+
+# Import local modules
+from utils.utilities import *
+
+# Default instruction stored in the Prompt field
+DEFAULT_PROMPT = "Convert the following question into a Cypher query using the provided graph schema!"
+
+# Keys observed in the model outputs
+QUESTION_KEYS = ("question", "questions", "query_text")
+CYPHER_KEYS = ("cypher", "cypher_statement", "cypher_statements", "cypher_query",
+               "cypher_queries", "queries", "query")
+
+#### Schema store ####
+
+class SchemaStore:
+    """Stores each schema once, keyed by a short content hash (the SchemaId)."""
+
+    def __init__(self, schemas: Optional[Dict[str, str]] = None) -> None:
+        self.schemas: Dict[str, str] = dict(schemas or {})
+
+    @staticmethod
+    def schema_id(schema: str) -> str:
+        """Short content hash of a schema string."""
+        return hashlib.sha256(schema.encode("utf-8")).hexdigest()[:12]
+
+    def add(self, schema: str) -> str:
+        """Adds a schema (if new) and returns its id."""
+        sid = self.schema_id(schema)
+        self.schemas.setdefault(sid, schema)
+        return sid
+
+    def get(self, sid: str) -> str:
+        """Returns the schema string of an id."""
+        return self.schemas[sid]
+
+    def save(self, file_path: str) -> None:
+        """Writes the schemas to a json file."""
+        write_json(self.schemas, file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> "SchemaStore":
+        """Reads the schemas from a json file, empty store if it does not exist."""
+        if not os.path.exists(file_path):
+            return cls()
+        return cls(read_json(file_path))
+
+#### Parsing of the observed output shapes ####
+
+def _first_value(d: Dict, keys: Tuple[str, ...]) -> Any:
+    """Value of the first key of keys present in d."""
+    for key in keys:
+        if key in d:
+            return d[key]
+    return None
+
+def _pair_from_dict(d: Dict) -> Optional[Tuple[Any, Any]]:
+    """Extracts (question, cypher) from one record.
+    Covers {question, cypher}, {question, query} and {query, cypher}."""
+    if "question" not in d and "query" in d and "cypher" in d:
+        # The question was returned under 'query'
+        return d["query"], d["cypher"]
+    question = _first_value(d, QUESTION_KEYS)
+    cypher = _first_value(d, CYPHER_KEYS)
+    if question is None or cypher is None:
+        return None
+    return question, cypher
+
+def iter_pairs(raw: Any) -> Iterator[Tuple[Any, Any]]:
+    """
+    Yields the (question, cypher) pairs of one raw model output, in any of the shapes:
+    - a JSON string of any of the shapes below
+    - a list of records
+    - a dict of parallel lists, e.g. {questions: [...], cypher_statements: [...]}
+    - a dict of one or more lists of records, e.g. {questions: [...], more_questions: [...]}
+    """
+
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError:
+            print(f"Couldn't parse: {raw[:100]}")
+            return
+
+    if isinstance(raw, list):
+        for d in raw:
+            if isinstance(d, dict):
+                pair = _pair_from_dict(d)
+                if pair is not None:
+                    yield pair
+        return
+
+    if not isinstance(raw, dict):
+        return
+
+    # Parallel lists of question strings and Cypher strings
+    questions = _first_value(raw, ("questions", "question"))
+    cyphers = _first_value(raw, CYPHER_KEYS)
+    if (isinstance(questions, list) and isinstance(cyphers, list)
+            and all(isinstance(q, str) for q in questions)):
+        if len(questions) != len(cyphers):
+            # The pairing is unknown, zip would silently misalign or drop entries
+            print(f"Skipped output with {len(questions)} questions "
+                  f"and {len(cyphers)} Cypher statements")
+            return
+        yield from zip(questions, cyphers)
+        return
+
+    # One or more lists of records
+    for value in raw.values():
+        if isinstance(value, list):
+            yield from iter_pairs(value)
+        elif isinstance(value, dict):
+            pair = _pair_from_dict(value)
+            if pair is not None:
+                yield pair
+
+#### Canonical records ####
+
+def _clean(value: Any) -> str:
+    """Stringify and strip a field."""
+    return value.strip() if isinstance(value, str) else ""
+
+def normalize_outputs(raw_outputs: Iterable[Any],
+                      schema: str,
+                      store: SchemaStore,
+                      prompt: str = DEFAULT_PROMPT,
+                      ) -> Iterator[Dict[str, str]]:
+    """
+    Streams canonical {Prompt, Question, SchemaId, Cypher} records from raw model
+    outputs. The schema is stored once in 'store'. Records with an empty question
+    or Cypher statement, and repeated (question, cypher) pairs, are dropped.
+    """
+
+    sid = store.add(schema)
+    seen = set()
+    for raw in raw_outputs:
+        for question, cypher in iter_pairs(raw):
+            question, cypher = _clean(question), _clean(cypher)
+            if not question or not cypher or (question, cypher) in seen:
+                continue
+            seen.add((question, cypher))
+            yield {"Prompt": prompt, "Question": question, "SchemaId": sid, "Cypher": cypher}
+
+def compact_records(records: Iterable[Dict[str, str]],
+                    store: SchemaStore,
+                    schema_prefix: str = "Graph schema: ",
+                    ) -> Iterator[Dict[str, str]]:
+    """Converts records with a full Schema string (parsed_synthetic.json format)
+    to records referencing the schema by SchemaId."""
+    for d in records:
+        schema = d["Schema"]
+        if schema.startswith(schema_prefix):
+            schema = schema[len(schema_prefix):]
+        yield {"Prompt": d["Prompt"], "Question": d["Question"],
+               "SchemaId": store.add(schema), "Cypher": d["Cypher"]}
+
+def expand_records(records: Iterable[Dict[str, str]],
+                   store: SchemaStore,
+                   schema_prefix: str = "Graph schema: ",
+                   ) -> Iterator[Dict[str, str]]:
+    """Restores the full {Prompt, Question, Schema, Cypher} records,
+    e.g. to build the training prompts."""
+    for d in records:
+        yield {"Prompt": d["Prompt"], "Question": d["Question"],
+               "Schema": schema_prefix + store.get(d["SchemaId"]), "Cypher": d["Cypher"]}
+
+def write_normalized(records: Iterable[Dict[str, str]],
+                     records_path: str,
+                     store: SchemaStore,
+                     schemas_path: str,
+                     ) -> int:
+    """Streams the records to a JSONL file and saves the schemas once to
+    a json file. Returns the number of records written."""
+    count = 0
+    with open(records_path, "w") as fp:
+        for d in records:
+            fp.write(json.dumps(d) + "\n")
+            count += 1
+    store.save(schemas_path)
+    return count
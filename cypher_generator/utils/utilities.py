@@ -4,6 +4,8 @@ import json
 from typing import Any, List, Dict
 import pickle
 from itertools import combinations
+from bisect import bisect_right
+import math
 import random
 from collections import defaultdict
 
@@ -18,6 +20,31 @@ def read_json(file_path: str) -> Any:
         data=json.load(fp)
         return data
 
+def append_jsonl(an_object: Any, file_path: str) -> None:
+    """Appends a Python object as one line to a json lines file."""
+    with open(file_path, "a") as fp:
+        fp.write(json.dumps(an_object) + "\n")
+
+def truncate_partial_line(file_path: str) -> None:
+    """Cuts a json lines file after its last newline, removing a partial
+    last line left by a crash, so that the next append starts a new line."""
+    with open(file_path, "rb+") as fp:
+        data = fp.read()
+        if data and not data.endswith(b"\n"):
+            fp.truncate(data.rfind(b"\n") + 1)
+
+def read_jsonl(file_path: str) -> List[Any]:
+    """Reads a json lines file to a list of Python objects.
+    A truncated last line (e.g. after a crash) is skipped."""
+    data = []
+    with open(file_path, "r") as fp:
+        for line in fp:
+            try:
+                data.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return data
+
 def write_pkl(an_object: Any, file_path: str) -> None:
     """Writes a Python object to a pickle file."""
     with open(file_path, 'wb') as f:
@@ -69,6 +96,106 @@ def get_random_elements(input_list, n):
     return random.sample(input_list, n)
 
 
+class RandomPairSampler:
+    """
+    Draws distinct random pairs of sublists that share the first element
+    (e.g. [label, property, value] instances with the same label), without
+    materializing all the combinations.
+
+    Every pair is identified by an integer: the groups own consecutive ranges of
+    size n*(n-1)/2 and a range index is mapped to (i, j), i < j, with index
+    arithmetic. Indices are drawn with a sparse Fisher-Yates shuffle: only the
+    swapped positions are stored, so each draw is O(1).
+    Replaces get_distinct_random_pairs, with the same output format.
+    """
+
+    def __init__(self,
+                 nlist: List[Any],
+                 seed: Any = None,
+                 min_remaining: int = 4):
+        """min_remaining - like get_distinct_random_pairs, stop drawing when
+        no more than min_remaining unused pairs are left."""
+        grouped_elements = defaultdict(list)
+        for sublist in nlist:
+            grouped_elements[sublist[0]].append(sublist)
+        self.groups = [values for values in grouped_elements.values() if len(values) > 1]
+
+        # Start of the pair index range of each group
+        self.offsets = []
+        total = 0
+        for values in self.groups:
+            self.offsets.append(total)
+            total += len(values) * (len(values) - 1) // 2
+        self.total = total
+
+        self.min_remaining = min_remaining
+        self.rng = random.Random(seed)
+        # Sparse Fisher-Yates state: position -> index moved there
+        self.swaps = {}
+        self.drawn = 0
+
+    @property
+    def remaining(self) -> int:
+        """Number of pairs not drawn yet."""
+        return self.total - self.drawn
+
+    def reset(self, seed: Any = None) -> None:
+        """Forgets the drawn pairs, optionally reseeds."""
+        self.swaps.clear()
+        self.drawn = 0
+        if seed is not None:
+            self.rng.seed(seed)
+
+    @staticmethod
+    def _index_to_pair(k: int, n: int):
+        """Maps k in [0, n*(n-1)/2) to the k-th pair (i, j), i < j, in
+        the order of itertools.combinations(range(n), 2)."""
+        i = n - 2 - int(math.sqrt(-8 * k + 4 * n * (n - 1) - 7) / 2.0 - 0.5)
+        # Guard against floating point rounding
+        while i * (2 * n - i - 1) // 2 > k:
+            i -= 1
+        while (i + 1) * (2 * n - i - 2) // 2 <= k:
+            i += 1
+        j = k - i * (2 * n - i - 1) // 2 + i + 1
+        return i, j
+
+    def _pair(self, index: int):
+        """The pair of sublists with a given global index."""
+        g = bisect_right(self.offsets, index) - 1
+        values = self.groups[g]
+        i, j = self._index_to_pair(index - self.offsets[g], len(values))
+        return values[i], values[j]
+
+    def _draw_index(self) -> int:
+        """Uniform random unused pair index, in O(1)."""
+        last = self.remaining - 1
+        position = self.rng.randrange(self.remaining)
+        index = self.swaps.get(position, position)
+        # Move the last unused index into the drawn position
+        self.swaps[position] = self.swaps.pop(last, last)
+        self.drawn += 1
+        return index
+
+    def draw(self) -> Any:
+        """Draws one unused pair as [label, prop1, value1, prop2, value2],
+        None when no more than min_remaining pairs are left."""
+        if self.remaining <= self.min_remaining:
+            return None
+        index = self._draw_index()
+        first, second = self._pair(index)
+        return [first[0], first[1], first[2], second[1], second[2]]
+
+    def draw_batch(self, k: int) -> List[Any]:
+        """Draws up to k pairs."""
+        batch = []
+        for _ in range(k):
+            result = self.draw()
+            if result is None:
+                break
+            batch.append(result)
+        return batch
+
+
 #### THESE NEED REVIEW ####
 
 def get_distinct_random_pairs(nlist: List[Any],
@@ -109,10 +236,11 @@ def get_distinct_random_pairs_optimized(nlist: List[Any],
     grouped_elements = defaultdict(list)
 
     for sublist in nlist:
-        grouped_elements[sublist[0]].append(sublist)
+        # Tuples, the pairs are stored in sets
+        grouped_elements[sublist[0]].append(tuple(sublist))
 
     valid_pairs = set()
-    for key, values in grouped_elements.values():
+    for key, values in grouped_elements.items():
         if len(values) > 1:
             for pair in combinations(values, 2):
                 if pair not in used_pairs:
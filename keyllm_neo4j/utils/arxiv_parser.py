@@ -3,20 +3,129 @@
 import json
 import csv
 import zipfile
+import io
 import os
-from typing import List, Dict
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Iterator, Optional, Union, TextIO, Tuple
 import pandas as pd
+import re
 import string
 
+# Names of the arxiv archive and of the JSON snapshot it contains
+ARXIV_ZIP = "archive.zip"
+ARXIV_FILE = "arxiv-metadata-oai-snapshot.json"
+
+# Read buffer for streaming the snapshot out of the zip (bytes)
+ZIP_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Translation table that removes punctuation, built once
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
+
+def _topic_needle(topic: str,
+                  binary: bool = False
+                  ) -> re.Pattern:
+    """
+    Pattern of the start of the snapshot lines of 'topic': the lines begin with
+    the id field, '{"id":"topic/...' (whitespace allowed around the separators).
+    binary - match bytes lines instead of str lines
+    """
+    pattern = r'\s*\{\s*"id"\s*:\s*"' + re.escape(topic) + "/"
+    return re.compile(pattern.encode("utf-8") if binary else pattern)
+
+
+def _parse_topic_line(line: Union[str, bytes],
+                      needle: re.Pattern,
+                      topic: str
+                      ) -> Optional[Dict]:
+    """
+    Parse a single snapshot line and return the record if it belongs to 'topic'.
+    Lines whose id field does not start with 'topic/' (the needle, see _topic_needle)
+    are rejected before decoding.
+    """
+
+    # Cheap prefix check, anchored on the id field at the start of the line
+    if needle.match(line) is None:
+        return None
+
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError:
+        # Print an error message if this line isn't valid JSON
+        print(f"Couldn't parse: {line}")
+        return None
+
+    # Split the 'id' field and check the topic
+    id_split = data["id"].split("/")
+    if id_split[0] != topic:
+        return None
+    data["id"] = id_split[1]
+    return data
+
+def _parse_shard(shard: Tuple[str, int, int, str]
+                 ) -> List[Dict]:
+    """
+    Worker function: parse the byte range [start, end) of the snapshot file.
+    The range boundaries are aligned to line starts by the caller.
+    """
+
+    file_path, start, end, topic = shard
+    needle = _topic_needle(topic, binary=True)
+    records = []
+
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            data = _parse_topic_line(line, needle, topic)
+            if data is not None:
+                records.append(data)
+    return records
+
+def shard_file(file_path: str,
+               n_shards: int
+               ) -> List[Tuple[int, int]]:
+    """
+    Splits a file into at most n_shards byte ranges (start, end), 
+    each one beginning at a line start and ending after a newline.
+    """
+
+    file_size = os.path.getsize(file_path)
+    step = max(1, file_size // max(1, n_shards))
+
+    bounds = [0]
+    with open(file_path, "rb") as f:
+        for offset in range(step, file_size, step):
+            if offset <= bounds[-1]:
+                continue
+            # Move to the start of the next full line
+            f.seek(offset)
+            f.readline()
+            position = f.tell()
+            if position >= file_size:
+                break
+            bounds.append(position)
+    bounds.append(file_size)
+
+    return [(bounds[i], bounds[i+1]) for i in range(len(bounds)-1)]
+
+
 class ArXivDataProcessor:
     """
     Class for processing large arxiv zip file, 
     featuring unzipping and parsing functionalities as follows:
     - read the large JSON file and select the articles with a specified topic
+    - optionally read the JSON snapshot straight from the zip, without extracting it
+    - stream the selected articles, one by one or in chunks, with constant memory
+    - parse newline aligned shards of the JSON file in a process pool
     - parse the id column from topic/id_number to id_number
     - evaluate the token length of the abstract
     - combine the title and the abstract into a single corpus
-    - save only selected articles
+    - save only selected articles, as csv or as a Parquet dataset with incremental appends
     """
 
     def __init__(self, 
@@ -30,48 +139,156 @@ class ArXivDataProcessor:
         Unzips the arxiv file (1.2GB) into a json file (3.7GB). 
         """
 
-        zip_path = self.data_path+"archive.zip"
+        zip_path = self.data_path+ARXIV_ZIP
         with zipfile.ZipFile(zip_path, "r") as fzip:
             # Extracts the data to a JSON file
             fzip.extractall(self.data_path)
 
+    @contextmanager
+    def open_snapshot(self,
+                      from_zip: bool = False
+                      )-> Iterator[TextIO]:
+        """
+        Opens the JSON snapshot as a text stream.
+
+        from_zip - if True, stream the lines straight out of the zip member with
+                   buffered decompression, so the 3.7GB file is never written to disk
+        """
+
+        if not from_zip:
+            with open(self.data_path + ARXIV_FILE, "r") as f:
+                yield f
+            return
+
+        with zipfile.ZipFile(self.data_path + ARXIV_ZIP, "r") as fzip:
+            with fzip.open(ARXIV_FILE, "r") as member:
+                buffered = io.BufferedReader(member, buffer_size=ZIP_BUFFER_SIZE)
+                with io.TextIOWrapper(buffered, encoding="utf-8") as f:
+                    yield f
+
+    def iter_topic(self,
+                   topic: str,
+                   chunk_size: Optional[int] = None,
+                   from_zip: bool = False
+                   )-> Iterator[Union[Dict, List[Dict]]]:
+        """
+        Streams the articles with provided 'topic', with parsed 'id' column.
+        Memory is constant, only one record (or one chunk) is held at a time.
+
+        topic - the arxiv topic, e.g. 'cs' or 'math'
+        chunk_size - if None yield single records, else lists of chunk_size records
+        from_zip - read the snapshot directly from archive.zip, default is False
+        """
+
+        needle = _topic_needle(topic)
+        chunk = []
+
+        with self.open_snapshot(from_zip) as f:
+            for line in f:
+                data = _parse_topic_line(line, needle, topic)
+                if data is None:
+                    continue
+                if chunk_size is None:
+                    yield data
+                    continue
+                chunk.append(data)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+
+        # Flush the last partial chunk
+        if chunk:
+            yield chunk
+
     def select_topic(self, 
-                     topic: str
+                     topic: str,
+                     from_zip: bool = False
                      )-> List[Dict]:
 
         """
         Function to extract articles with provided 'topic' and to parse
-        the 'id' column.
+        the 'id' column. With from_zip=True the archive does not need unzipping.
         """
 
-        # Initialize an empty list to store the extracted entries.
-        filtered_records = []
+        # Collect all the streamed entries for the topic
+        filtered_records = list(self.iter_topic(topic, from_zip=from_zip))
 
-        # Variables for the data filename and path.
-        arxiv_file = "arxiv-metadata-oai-snapshot.json"
-        arxiv_file_path = self.data_path + arxiv_file
+        print(f"There are {len(filtered_records)} with {topic} topic.")
+        
+        return filtered_records
 
-        with open(arxiv_file_path, "r") as f:
-            for line in f:
-                try:
-                    # Load the JSON object from the line
-                    data = json.loads(line)
+    def select_topic_parallel(self,
+                              topic: str,
+                              n_workers: Optional[int] = None,
+                              n_shards: Optional[int] = None
+                              )-> List[Dict]:
+        """
+        Parallel version of select_topic, works on the extracted JSON file.
+        The file is split into byte ranges aligned to newlines, each shard is
+        filtered and decoded in a process pool and the results are merged
+        in the original file order.
 
-                    # Split the 'id' field and check the topic 
-                    id_split = data["id"].split("/")
-                    if id_split[0] == topic:
-                        data["id"] = id_split[1]
-                        # Keep this record for the chosen topic
-                        filtered_records.append(data)
+        topic - the arxiv topic, e.g. 'cs' or 'math'
+        n_workers - number of processes, default is os.cpu_count()
+        n_shards - number of shards, default is 4 shards per worker
+        """
+
+        n_workers = n_workers or os.cpu_count() or 1
+        n_shards = n_shards or 4 * n_workers
 
-                except json.JSONDecodeError:
-                    # Print an error message if this line isn't valid JSON
-                    print(f"Couldn't parse: {line}")
+        arxiv_file_path = self.data_path + ARXIV_FILE
+        shards = [(arxiv_file_path, start, end, topic) 
+                  for start, end in shard_file(arxiv_file_path, n_shards)]
+
+        # map() returns the shard results in submission order
+        filtered_records = []
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for records in executor.map(_parse_shard, shards):
+                filtered_records.extend(records)
 
         print(f"There are {len(filtered_records)} with {topic} topic.")
-        
+
         return filtered_records
 
+    def benchmark_select_topic(self,
+                               topic: str,
+                               n_workers: Optional[int] = None,
+                               n_shards: Optional[int] = None
+                               )-> Dict[str, float]:
+        """
+        Times the serial select_topic against select_topic_parallel
+        and checks that both return the same records.
+        The snapshot is read once beforehand, so both runs start with the same
+        page cache (the serial run would otherwise warm it for the parallel one).
+        """
+
+        # Warm-up read
+        with open(self.data_path + ARXIV_FILE, "rb") as f:
+            while f.read(ZIP_BUFFER_SIZE):
+                pass
+
+        start = time.perf_counter()
+        serial = self.select_topic(topic)
+        serial_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parallel = self.select_topic_parallel(topic, n_workers, n_shards)
+        parallel_time = time.perf_counter() - start
+
+        if serial != parallel:
+            raise ValueError("Serial and parallel parsing returned different records.")
+
+        results = {
+            "records": len(serial),
+            "serial_seconds": serial_time,
+            "parallel_seconds": parallel_time,
+            "speedup": serial_time / parallel_time if parallel_time else float("inf"),
+        }
+        print(f"Serial: {serial_time:.2f}s, parallel: {parallel_time:.2f}s, "
+              f"speedup: {results['speedup']:.2f}x")
+
+        return results
+
 
     def count_tokens(self, 
                      paragraph: str
@@ -81,8 +298,7 @@ class ArXivDataProcessor:
         """
 
         # Remove punctuation from the paragraph
-        trans = str.maketrans("", "", string.punctuation)
-        clean_paragraph = paragraph.translate(trans)
+        clean_paragraph = paragraph.translate(PUNCTUATION_TABLE)
 
         # Tokenize the cleaned paragraph into words by splitting on spaces
         tokens = clean_paragraph.split()
@@ -90,6 +306,17 @@ class ArXivDataProcessor:
         # Return the number of tokens
         return len(tokens)
 
+    def count_tokens_series(self,
+                            paragraphs: pd.Series
+                            ) -> pd.Series:
+        """
+        Vectorized count_tokens: counts the tokens of every paragraph in a Series
+        with pandas string methods, without per-row Python calls.
+        """
+
+        # Remove punctuation, then count the runs of non-whitespace characters
+        return paragraphs.str.translate(PUNCTUATION_TABLE).str.count(r"\S+")
+
     def select_articles(self,
                         entries: List[Dict],
                         cols=None, # Chose columns to keep
@@ -111,35 +338,122 @@ class ArXivDataProcessor:
 
         # Write data as a pandas dataframe
         df = pd.DataFrame(entries)
-        # Create a column that records the abstract token length
-        df["abs_length"] = [self.count_tokens(x) for x in df["abstract"]]
+        # Record the abstract token length
+        abs_length = self.count_tokens_series(df["abstract"])
         # Choose the articles based on abstract length
-        df_selected = df[(df["abs_length"] >= min_length) & (df["abs_length"] <= max_length)]
+        mask = (abs_length >= min_length) & (abs_length <= max_length)
+
+        # Columns to retain, do not modify the caller's list
+        cols = list(cols) if cols else list(df.columns)
+
+        # Build the output from the selected rows of the retained columns only
+        selected = {col: df[col][mask] for col in cols}
         # Retain if retaining the abs_length
         if keep_abs_length:
-            cols += ["abs_length"] 
-        else:
-            cols = cols
+            selected["abs_length"] = abs_length[mask]
         # Create a corpus column
-        df_selected = df_selected.copy()
         if build_corpus:
-            df_selected["corpus"] = df["title"] + ";" + df["abstract"]
-            cols+=["corpus"]
-        # Retain only the selected columns
-        if cols:
-            df_selected = df_selected[cols]
+            selected["corpus"] = df["title"][mask].str.cat(df["abstract"][mask], sep=";")
+        df_selected = pd.DataFrame(selected)
 
         print(f"There are {df_selected.shape[0]} articles selected.")
         return df_selected
 
     def save_selected_data(self, 
                            selected_data: pd.DataFrame,
-                           topic: str
+                           topic: str,
+                           file_format: str = "csv"
                            ) -> None:
         """
-        Saves the selected data to a csv file.
+        Saves the selected data to a csv file, or to a Parquet dataset.
+
+        file_format - 'csv' writes selected_{topic}.csv, 
+                      'parquet' writes the directory selected_{topic}.parquet,
+                      which keeps list columns (e.g. titles_keys) as native lists
         """
-        # The output filename
-        output_file = f"selected_{topic}.csv"
-        # Save the selected data
-        selected_data.to_csv(self.data_path+output_file, index=False)
\ No newline at end of file
+
+        if file_format == "csv":
+            # The output filename
+            output_file = f"selected_{topic}.csv"
+            # Save the selected data
+            selected_data.to_csv(self.data_path+output_file, index=False)
+        elif file_format == "parquet":
+            # Replace any previous parts of the dataset
+            dataset_path = self.parquet_path(topic)
+            os.makedirs(dataset_path, exist_ok=True)
+            for part in self._parquet_parts(topic):
+                os.remove(os.path.join(dataset_path, part))
+            self._write_parquet_part(selected_data, topic)
+        else:
+            raise ValueError("file_format must be either 'csv' or 'parquet'")
+
+    def append_selected_data(self,
+                             selected_data: pd.DataFrame,
+                             topic: str,
+                             key: str = "id"
+                             ) -> pd.DataFrame:
+        """
+        Incremental save to the Parquet dataset: appends, as a new part file,
+        only the articles whose 'key' is not already stored (the first of repeated
+        keys in selected_data). Returns the new rows.
+        Useful for the monthly snapshot refreshes.
+        """
+
+        new_data = selected_data.drop_duplicates(subset=key)
+        if self._parquet_parts(topic):
+            # Read only the key column of the stored data
+            stored_keys = self.load_selected_data(topic, columns=[key], file_format="parquet")[key]
+            new_data = new_data[~new_data[key].isin(stored_keys)]
+
+        if not new_data.empty:
+            self._write_parquet_part(new_data, topic)
+
+        print(f"Appended {new_data.shape[0]} new articles to selected_{topic}.parquet.")
+        return new_data
+
+    def load_selected_data(self,
+                           topic: str,
+                           columns: Optional[List[str]] = None,
+                           file_format: str = "csv"
+                           ) -> pd.DataFrame:
+        """
+        Loads the selected data for a topic.
+
+        columns - columns to read, if None all the columns are read;
+                  for Parquet only these columns are read from disk
+        file_format - 'csv' (default, as save_selected_data) or 'parquet'
+        """
+
+        if file_format == "parquet":
+            return pd.read_parquet(self.parquet_path(topic), columns=columns)
+        elif file_format == "csv":
+            return pd.read_csv(self.data_path+f"selected_{topic}.csv", usecols=columns)
+        raise ValueError("file_format must be either 'csv' or 'parquet'")
+
+    def parquet_path(self,
+                     topic: str
+                     ) -> str:
+        """Path of the Parquet dataset (a directory of part files) for a topic."""
+        return self.data_path + f"selected_{topic}.parquet"
+
+    def _parquet_parts(self,
+                       topic: str
+                       ) -> List[str]:
+        """Sorted list of the part files in the Parquet dataset of a topic."""
+        dataset_path = self.parquet_path(topic)
+        if not os.path.isdir(dataset_path):
+            return []
+        return sorted(f for f in os.listdir(dataset_path) 
+                      if f.startswith("part-") and f.endswith(".parquet"))
+
+    def _write_parquet_part(self,
+                            data: pd.DataFrame,
+                            topic: str
+                            ) -> None:
+        """Writes a dataframe as the next part file of the Parquet dataset."""
+        dataset_path = self.parquet_path(topic)
+        os.makedirs(dataset_path, exist_ok=True)
+        parts = self._parquet_parts(topic)
+        next_part = int(parts[-1][5:-8]) + 1 if parts else 0
+        data.to_parquet(os.path.join(dataset_path, f"part-{next_part:05d}.parquet"), 
+                        index=False)
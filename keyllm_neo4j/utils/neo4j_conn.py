@@ -1,6 +1,10 @@
 """Graph database connector and query parsers"""
 
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import threading
+import time
 import neo4j
 from neo4j.exceptions import CypherSyntaxError
 import pandas as pd
@@ -20,6 +24,8 @@ class Neo4jGraph:
         self._driver = neo4j.GraphDatabase.driver(url,
                                                    auth=(username, password))
         self._database = database
+        # Session shared by the query() calls of the thread inside reuse_session()
+        self._local = threading.local()
 
         # Verify the connection
         try:
@@ -46,10 +52,86 @@ class Neo4jGraph:
               ) -> List[Dict[str, Any]]:
         """Query Neo4j database."""
 
+        # Inside reuse_session() run on this thread's shared session
+        shared = getattr(self._local, "session", None)
+        if shared is not None:
+            return self._run(shared, cypher_query, params)
+
+        with self._driver.session(database=self._database) as session:
+            return self._run(session, cypher_query, params)
+
+    def _run(self,
+             session: neo4j.Session,
+             cypher_query: str,
+             params: dict,
+             ) -> List[Dict[str, Any]]:
+        """Run a query on an open session and return all the records."""
+        try:
+            data = session.run(cypher_query, params)
+            return [r.data() for r in data]
+        except CypherSyntaxError as e:
+            raise ValueError(
+                "Cypher Statement is not valid\n" f"{e}") 
+
+    @contextmanager
+    def reuse_session(self) -> Iterator[neo4j.Session]:
+        """Context manager: all query() calls of this thread inside the block
+        share one session. Other threads keep opening their own sessions."""
+
+        shared = getattr(self._local, "session", None)
+        if shared is not None:
+            # Already inside a reuse_session() block
+            yield shared
+            return
+
         with self._driver.session(database=self._database) as session:
+            self._local.session = session
             try:
-                data = session.run(cypher_query, params)
-                return [r.data() for r in data]
+                yield session
+            finally:
+                self._local.session = None
+
+    def query_batch(self,
+                    statements: Sequence[Union[str, Tuple[str, dict]]],
+                    ) -> List[List[Dict[str, Any]]]:
+        """Run a batch of statements on a single session.
+        Each statement is a query string or a (query, params) tuple."""
+
+        results = []
+        with self.reuse_session():
+            for statement in statements:
+                if isinstance(statement, str):
+                    statement = (statement, {})
+                results.append(self.query(*statement))
+        return results
+
+    def stream_query(self,
+                     cypher_query: str,
+                     params: dict = {},
+                     fetch_size: int = 1000,
+                     chunk_size: Optional[int] = None,
+                     ) -> Iterator[Union[Dict[str, Any], pd.DataFrame]]:
+        """Stream the results of a query lazily.
+        The driver pulls fetch_size records at a time from the server.
+        If chunk_size is None yield one record (dict) at a time,
+        else yield DataFrames with up to chunk_size rows."""
+
+        with self._driver.session(database=self._database,
+                                  fetch_size=fetch_size) as session:
+            try:
+                result = session.run(cypher_query, params)
+                chunk = []
+                for r in result:
+                    if chunk_size is None:
+                        yield r.data()
+                        continue
+                    chunk.append(r.data())
+                    if len(chunk) == chunk_size:
+                        yield pd.DataFrame(chunk)
+                        chunk = []
+                # Flush the last partial chunk
+                if chunk:
+                    yield pd.DataFrame(chunk)
             except CypherSyntaxError as e:
                 raise ValueError(
                     "Cypher Statement is not valid\n" f"{e}") 
@@ -62,6 +144,67 @@ class Neo4jGraph:
 
         self.query(cypher_query,
                    params={'rows': df.to_dict('records')})
+
+    def _write_batch(self,
+                     cypher_query: str,
+                     rows: List[Dict[str, Any]],
+                     ) -> int:
+        """Write one batch of rows in its own managed write transaction.
+        The driver retries the transaction function on transient errors."""
+
+        def work(tx):
+            tx.run(cypher_query, {'rows': rows}).consume()
+
+        with self._driver.session(database=self._database) as session:
+            session.execute_write(work)
+        return len(rows)
+
+    def bulk_load_data(self,
+                       cypher_query: str,
+                       df: pd.DataFrame,
+                       batch_size: int = 1000,
+                       n_workers: int = 1,
+                       ) -> Dict[str, float]:
+        """Load data to Neo4j from a Pandas dataframe in batches.
+
+        The query must consume the batch with UNWIND $rows AS row.
+        Each batch of batch_size rows runs in its own write transaction,
+        with n_workers > 1 the batches run in parallel sessions.
+        Only use parallel batches when they do not MERGE the same nodes.
+        Returns the number of rows, batches, seconds and rows/sec.
+        """
+
+        # Convert the dataframe to records one batch at a time
+        batches = (df.iloc[start:start + batch_size].to_dict('records')
+                   for start in range(0, len(df), batch_size))
+
+        start_time = time.perf_counter()
+        if n_workers > 1:
+            # Sliding window of at most 2 * n_workers batches in flight,
+            # so the records are not all materialized up front
+            loaded = 0
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                pending = set()
+                for rows in batches:
+                    if len(pending) >= 2 * n_workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        loaded += sum(future.result() for future in done)
+                    pending.add(executor.submit(self._write_batch, cypher_query, rows))
+                loaded += sum(future.result() for future in pending)
+        else:
+            loaded = sum(self._write_batch(cypher_query, rows) for rows in batches)
+        elapsed = time.perf_counter() - start_time
+
+        stats = {
+            'rows': loaded,
+            'batches': -(-len(df) // batch_size),
+            'seconds': elapsed,
+            'rows_per_sec': loaded / elapsed if elapsed else float('inf'),
+        }
+        print(f"Loaded {loaded} rows in {stats['batches']} batches, "
+              f"{elapsed:.2f}s ({stats['rows_per_sec']:.0f} rows/sec)")
+        return stats
+
     
         
         